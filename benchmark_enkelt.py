@@ -0,0 +1,440 @@
+import os
+import io
+import sys
+import json
+import time
+import statistics
+import argparse
+import threading
+import functools
+import contextlib
+import http.server
+
+import enkelt
+import enkelt_lsp
+
+
+def get_benchmark_file_name(name):
+    return 'TestResources/benchmark/' + name + '.json'
+
+
+def to_letters(number):
+    # Library names can't contain digits, 0 -> 'a', 1 -> 'b', ..., 26 -> 'ba'
+    letters = ''
+    while True:
+        letters = chr(ord('a') + number % 26) + letters
+        number //= 26
+        if number == 0:
+            return letters
+
+
+# ####### #
+# CORPORA #
+# ####### #
+
+def long_lines_corpus():
+    lines = []
+    for line_index in range(40):
+        terms = ' + '.join(str(term) for term in range(120))
+        lines.append('$summa_' + str(line_index) + ' = ' + terms + '\n')
+    return lines
+
+
+def deep_nesting_corpus():
+    # Python only allows 20 statically nested blocks
+    depth = 15
+    lines = []
+    for repetition in range(20):
+        for level in range(depth):
+            lines.append('\t' * level + 'medan ($n' + to_letters(level) + ' < 1) {\n')
+            lines.append('\t' * (level + 1) + '$n' + to_letters(level) + ' = 1\n')
+        for level in range(depth - 1, -1, -1):
+            lines.append('\t' * level + '}\n')
+    return ['$n' + to_letters(level) + ' = 0\n' for level in range(15)] + lines
+
+
+def many_functions_corpus():
+    lines = []
+    for function_index in range(300):
+        name = 'funktion_' + to_letters(function_index)
+        lines.append('def ' + name + '($a, $b) {\n')
+        lines.append('\t$c = $a * $b + 1\n')
+        lines.append('\treturnera $c\n')
+        lines.append('}\n')
+        lines.append('$resultat = ' + name + '(2, 3)\n')
+    return lines
+
+
+def big_literals_corpus():
+    lines = []
+    for line_index in range(30):
+        strings = ', '.join('"text nummer ' + str(item) + '"' for item in range(60))
+        lines.append('$lista_' + str(line_index) + ' = [' + strings + ']\n')
+        pairs = ', '.join('"nyckel' + str(item) + '": ' + str(item) for item in range(60))
+        lines.append('$lexikon_' + str(line_index) + ' = {' + pairs + '}\n')
+    return lines
+
+
+def numeric_loop_corpus():
+    return [
+        '$i = 0\n',
+        '$summa = 0\n',
+        'medan ($i < 300000) {\n',
+        '\t$summa = $summa + $i * 2\n',
+        '\t$i = $i + 1\n',
+        '}\n',
+    ]
+
+
+def get_library_code(library_index):
+    return ''.join([
+        'def hej($a) {\n',
+        '\treturnera $a + ' + str(library_index) + '\n',
+        '}\n',
+    ])
+
+
+def many_imports_corpus(library_count=40):
+    lines = []
+    for library_index in range(library_count):
+        library_name = 'modul' + to_letters(library_index)
+        lines.append('importera ' + library_name + '\n')
+        lines.append('$svar = ' + library_name + '.hej(1)\n')
+    return lines
+
+
+def large_file_corpus():
+    # About 50 000 lines, for the language server
+    return many_functions_corpus() * 34
+
+
+def get_corpora():
+    return {
+        'long_lines': long_lines_corpus,
+        'deep_nesting': deep_nesting_corpus,
+        'many_functions': many_functions_corpus,
+        'big_literals': big_literals_corpus,
+        'numeric_loop': numeric_loop_corpus,
+        'many_imports': many_imports_corpus,
+        'large_file': large_file_corpus,
+    }
+
+
+# ############################ #
+# LOCAL STAND-IN IMPORT SERVER #
+# ############################ #
+
+class LibraryRequestHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        library_name = self.path.strip('/')
+        if library_name.startswith('modul') and library_name.endswith('.e'):
+            library_letters = library_name[len('modul'):-len('.e')]
+            library_index = 0
+            for letter in library_letters:
+                library_index = library_index * 26 + ord(letter) - ord('a')
+
+            body = get_library_code(library_index).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            self.send_error(404)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@contextlib.contextmanager
+def library_server():
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), LibraryRequestHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    web_import_location = enkelt.web_import_location
+    enkelt.web_import_location = 'http://127.0.0.1:' + str(server.server_address[1]) + '/'
+    try:
+        yield
+    finally:
+        enkelt.web_import_location = web_import_location
+        server.shutdown()
+        server.server_close()
+
+
+# ###### #
+# STAGES #
+# ###### #
+
+def run_lex(lines):
+    enkelt.reset_transpiler_state()
+    fixed_lines = [enkelt.fix_up_code_line(line) for line in lines if line != '\n']
+
+    start_time = time.perf_counter()
+    for line in fixed_lines:
+        enkelt.lex(line)
+    return time.perf_counter() - start_time
+
+
+def run_parse(lines):
+    enkelt.reset_transpiler_state()
+    lexed_lines = [enkelt.lex(enkelt.fix_up_code_line(line)) for line in lines if line != '\n']
+    enkelt.reset_transpiler_state()
+
+    start_time = time.perf_counter()
+    for lexed in lexed_lines:
+        enkelt.parse(lexed, 0)
+        enkelt.source_code = []
+    return time.perf_counter() - start_time
+
+
+def transpile(lines):
+    enkelt.reset_transpiler_state()
+    for line_number, line in enumerate(lines, 1):
+        enkelt.transpile_line(line, line_number)
+    return enkelt.compile_transpiled_code(enkelt.fix_up_and_prepare_transpiled_code())
+
+
+def run_transpile(lines):
+    start_time = time.perf_counter()
+    transpile(lines)
+    return time.perf_counter() - start_time
+
+
+def run_execution(lines):
+    compiled = transpile(lines)
+    namespace = enkelt.get_program_namespace()
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        start_time = time.perf_counter()
+        enkelt.execute_compiled_code(compiled, namespace)
+        return time.perf_counter() - start_time
+
+
+def run_execution_at_module_level(lines):
+    # The program's variables are dictionary globals instead of fast locals
+    enkelt.is_fast_locals_mode = False
+    try:
+        return run_execution(lines)
+    finally:
+        enkelt.is_fast_locals_mode = True
+
+
+@functools.lru_cache(maxsize=1)
+def open_language_server_document(text):
+    return enkelt_lsp.EnkeltDocument(text)
+
+
+def run_language_server_open(lines):
+    text = ''.join(lines)
+
+    start_time = time.perf_counter()
+    enkelt_lsp.EnkeltDocument(text)
+    return time.perf_counter() - start_time
+
+
+def run_language_server_change(lines):
+    document = open_language_server_document(''.join(lines))
+    middle_line = len(document.lines) // 2
+
+    # A line is written in the middle of the document and removed again
+    start_time = time.perf_counter()
+    document.apply_change({
+        'range': {'start': {'line': middle_line, 'character': 0}, 'end': {'line': middle_line, 'character': 0}},
+        'text': '\t$ny = 1\n',
+    })
+    document.apply_change({
+        'range': {'start': {'line': middle_line, 'character': 0}, 'end': {'line': middle_line + 1, 'character': 0}},
+        'text': '',
+    })
+    return time.perf_counter() - start_time
+
+
+def run_language_server_range_tokens(lines):
+    document = open_language_server_document(''.join(lines))
+    middle_line = len(document.lines) // 2
+    document.apply_change({
+        'range': {'start': {'line': middle_line, 'character': 0}, 'end': {'line': middle_line, 'character': 0}},
+        'text': '',
+    })
+
+    # What the editor asks for after a change: the visible lines
+    start_time = time.perf_counter()
+    document.get_semantic_tokens(middle_line - 50, middle_line + 50)
+    return time.perf_counter() - start_time
+
+
+def run_language_server_full_tokens(lines):
+    document = open_language_server_document(''.join(lines))
+    middle_line = len(document.lines) // 2
+    document.apply_change({
+        'range': {'start': {'line': middle_line, 'character': 0}, 'end': {'line': middle_line, 'character': 0}},
+        'text': '',
+    })
+
+    # Every line is lexed by the first request, the later ones only put the lines' tokens together
+    start_time = time.perf_counter()
+    document.get_semantic_tokens()
+    return time.perf_counter() - start_time
+
+
+def run_language_server_definition(lines):
+    document = open_language_server_document(''.join(lines))
+    document.apply_change({
+        'range': {'start': {'line': 0, 'character': 0}, 'end': {'line': 0, 'character': 0}},
+        'text': '',
+    })
+
+    start_time = time.perf_counter()
+    document.get_definition_line(len(document.lines) - 2, len('$resultat = '))
+    return time.perf_counter() - start_time
+
+
+# Plain Python that doesn't change when Enkelt does, every stage is measured relative to it in the same run. A slower
+# or busier machine makes both slower, so the gate doesn't depend on the machine the baseline was saved on
+def reference_workload():
+    words = [str(number).replace('1', 'ett') for number in range(20000)]
+    counts = {}
+    for word in ','.join(words).split(','):
+        counts[word[:3]] = counts.get(word[:3], 0) + 1
+    return len(counts)
+
+
+def run_reference():
+    start_time = time.perf_counter()
+    reference_workload()
+    return time.perf_counter() - start_time
+
+
+def get_stages(corpus_name):
+    # The large file is only used for the language server, the other stages would take minutes
+    if corpus_name == 'large_file':
+        return {
+            'lsp_open': run_language_server_open,
+            'lsp_change': run_language_server_change,
+            'lsp_range_tokens': run_language_server_range_tokens,
+            'lsp_full_tokens': run_language_server_full_tokens,
+            'lsp_definition': run_language_server_definition,
+        }
+
+    return {
+        'lex': run_lex,
+        'parse': run_parse,
+        'transpile': run_transpile,
+        'execution': run_execution,
+        'execution_module_level': run_execution_at_module_level,
+    }
+
+
+def run_benchmarks(repeats, corpus_names=None):
+    results = {}
+
+    try:
+        with library_server():
+            for corpus_name, corpus in get_corpora().items():
+                if corpus_names and corpus_name not in corpus_names:
+                    continue
+
+                lines = corpus()
+                results[corpus_name] = {}
+                for stage_name, stage in get_stages(corpus_name).items():
+                    # The reference runs right before every run of the stage, so both see the same noise. The median
+                    # isn't moved by one disturbed run, in either direction
+                    stage_times = []
+                    relative_times = []
+                    for _ in range(repeats):
+                        reference_time = run_reference()
+                        stage_time = stage(lines)
+                        stage_times.append(stage_time)
+                        relative_times.append(stage_time / reference_time)
+
+                    results[corpus_name][stage_name] = {
+                        'time': statistics.median(stage_times),
+                        'relative': statistics.median(relative_times),
+                    }
+    finally:
+        enkelt.reset_transpiler_state()
+
+    return results
+
+
+# The baseline's time for a stage in this run, ex. half of the reference's time when the stage took half of it then
+def get_baseline_time(result, baseline_result):
+    # Baselines from before the reference only have a time
+    if not isinstance(baseline_result, dict):
+        return None
+
+    return baseline_result['relative'] * result['time'] / result['relative']
+
+
+def compare_with_baseline(results, baseline, threshold, min_difference):
+    regressions = []
+
+    for corpus_name, stage_results in results.items():
+        for stage_name, result in stage_results.items():
+            baseline_time = get_baseline_time(result, baseline.get(corpus_name, {}).get(stage_name))
+            if baseline_time:
+                ratio = result['time'] / baseline_time
+                # Very short stages are dominated by noise, so a small absolute difference is never a regression
+                if ratio > threshold and result['time'] - baseline_time > min_difference:
+                    regressions.append((corpus_name, stage_name, baseline_time, result['time'], ratio))
+
+    return regressions
+
+
+def print_results(results, baseline):
+    print('{:<16} {:<22} {:>12} {:>12} {:>8}'.format('Korpus', 'Steg', 'Tid (ms)', 'Bas (ms)', 'Kvot'))
+
+    for corpus_name, stage_results in results.items():
+        for stage_name, result in stage_results.items():
+            baseline_time = get_baseline_time(result, baseline.get(corpus_name, {}).get(stage_name))
+            print('{:<16} {:<22} {:>12.3f} {:>12} {:>8}'.format(
+                corpus_name,
+                stage_name,
+                result['time'] * 1000,
+                '{:.3f}'.format(baseline_time * 1000) if baseline_time else '-',
+                '{:.2f}'.format(result['time'] / baseline_time) if baseline_time else '-'
+            ))
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description='Prestandatester för Enkelts lexer, parser och körning.')
+    parser.add_argument('--korpus', nargs='*', help='kör bara de angivna korpusarna')
+    parser.add_argument('--upprepningar', type=int, default=5, help='antal körningar per steg (medianen räknas)')
+    parser.add_argument('--spara', help='sparar resultatet som JSON i den angivna filen')
+    parser.add_argument('--baslinje', default=get_benchmark_file_name('baseline'), help='baslinjen att jämföra med')
+    parser.add_argument('--gräns', type=float, default=2.0, help='största tillåtna kvot mot baslinjen')
+    parser.add_argument('--minsta-skillnad', type=float, default=5.0, help='minsta skillnad i ms som räknas')
+    parser.add_argument('--ny-baslinje', action='store_true', help='sparar resultatet som ny baslinje')
+    options = parser.parse_args(args)
+
+    results = run_benchmarks(options.upprepningar, options.korpus)
+
+    baseline = {}
+    if os.path.isfile(options.baslinje):
+        with open(options.baslinje, encoding='utf-8') as baseline_file:
+            baseline = json.load(baseline_file)
+
+    print_results(results, baseline)
+
+    if options.spara:
+        with open(options.spara, 'w', encoding='utf-8') as results_file:
+            json.dump(results, results_file, indent=4)
+
+    if options.ny_baslinje:
+        with open(options.baslinje, 'w', encoding='utf-8') as baseline_file:
+            json.dump(results, baseline_file, indent=4)
+        return 0
+
+    regressions = compare_with_baseline(
+        results, baseline, options.gräns, options.minsta_skillnad / 1000
+    )
+    for corpus_name, stage_name, baseline_time, stage_time, ratio in regressions:
+        print('Prestandaförsämring: {} / {} tog {:.3f} ms (baslinje {:.3f} ms, kvot {:.2f})'.format(
+            corpus_name, stage_name, stage_time * 1000, baseline_time * 1000, ratio
+        ))
+
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
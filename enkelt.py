@@ -20,10 +20,14 @@
 import sys
 import re
 import os
+import ast
+import types
+import functools
 import collections
 import urllib.request
 
-# For the standard library
+# For the standard library, the modules that are slow to import are imported where they're used
+import json
 import math
 import time
 import datetime
@@ -63,6 +67,474 @@ class StandardLibrary:
         datum = datetime.date
         nu = datetime.datetime.now
         idag = datetime.date.today
+        mät = time.perf_counter_ns
+
+        # Used by the "tidtagning {" block, prints the time the block took when it ends
+        class Tidtagning:
+            def __init__(self, namn=''):
+                self.namn = namn
+                self.start_times = []
+
+            def __call__(self, namn=''):
+                return StandardLibrary.tid.Tidtagning(namn)
+
+            def __enter__(self):
+                self.start_times.append(time.perf_counter_ns())
+
+            def __exit__(self, *_):
+                elapsed = time.perf_counter_ns() - self.start_times.pop()
+                print('Tidtagning' + (' ' + self.namn if self.namn else '') + ': ' + format_duration(elapsed))
+                return False
+
+        tidtagning = Tidtagning()
+
+        @staticmethod
+        def jämför(funktion, gånger=1000, uppvärmning=10):
+            # The first calls fill caches & warm up the interpreter, so they're not measured
+            for _ in range(uppvärmning):
+                funktion()
+
+            timings = []
+            for _ in range(gånger):
+                start_time = time.perf_counter_ns()
+                funktion()
+                timings.append(time.perf_counter_ns() - start_time)
+            timings.sort()
+
+            def percentile(part):
+                return timings[max(0, math.ceil(part * len(timings)) - 1)]
+
+            return {
+                'gånger': len(timings),
+                'min': timings[0],
+                'median': percentile(0.5),
+                'p90': percentile(0.9),
+                'p99': percentile(0.99),
+                'max': timings[-1],
+                'medel': sum(timings) // len(timings),
+            }
+
+    class parallell:
+        antal_arbetare = os.cpu_count() or 1
+
+        @staticmethod
+        def arbetare(antal):
+            StandardLibrary.parallell.antal_arbetare = antal
+
+        @staticmethod
+        def karta(funktion, lista, bitar=0):
+            import multiprocessing
+            import concurrent.futures
+
+            lista = list(lista)
+
+            # Without fork the workers can't find the program's functions, so they are run one by one
+            if StandardLibrary.parallell.antal_arbetare <= 1 or 'fork' not in multiprocessing.get_all_start_methods():
+                return list(map(funktion, lista))
+
+            # A few chunks per worker, so that a slow chunk doesn't leave the other workers waiting
+            if not bitar:
+                bitar = max(1, math.ceil(len(lista) / (StandardLibrary.parallell.antal_arbetare * 4)))
+
+            with concurrent.futures.ProcessPoolExecutor(
+                    max_workers=StandardLibrary.parallell.antal_arbetare,
+                    mp_context=multiprocessing.get_context('fork')
+            ) as executor:
+                return list(executor.map(funktion, lista, chunksize=bitar))
+
+        @staticmethod
+        def filtrera(funktion, lista, bitar=0):
+            lista = list(lista)
+            keep = StandardLibrary.parallell.karta(funktion, lista, bitar)
+
+            return [item for item, is_kept in zip(lista, keep) if is_kept]
+
+    class asynk:
+        @staticmethod
+        async def sov(sekunder):
+            import asyncio
+
+            await asyncio.sleep(sekunder)
+
+        @staticmethod
+        async def samla(*uppgifter):
+            import asyncio
+
+            return list(await asyncio.gather(*uppgifter))
+
+        @staticmethod
+        async def läs(sökväg):
+            import asyncio
+
+            def read():
+                with open(sökväg, encoding='utf-8') as file:
+                    return file.read()
+
+            return await asyncio.get_running_loop().run_in_executor(None, read)
+
+        @staticmethod
+        async def hämta(url):
+            import asyncio
+
+            def fetch():
+                with urllib.request.urlopen(url) as response:
+                    return response.read().decode('utf-8')
+
+            return await asyncio.get_running_loop().run_in_executor(None, fetch)
+
+    class fil:
+        # Files are read in blocks of this many bytes
+        buffert_storlek = 1024 * 1024
+
+        @staticmethod
+        def rader(sökväg):
+            with open(sökväg, encoding='utf-8', buffering=StandardLibrary.fil.buffert_storlek) as file:
+                for line in file:
+                    yield line.rstrip('\n')
+
+        @staticmethod
+        def läs_bytes(sökväg, storlek=0):
+            with open(sökväg, 'rb') as file:
+                while True:
+                    chunk = file.read(storlek or StandardLibrary.fil.buffert_storlek)
+                    if not chunk:
+                        return
+                    yield chunk
+
+        @staticmethod
+        def skriv_alla(sökväg, rader, lägg_till=False):
+            with open(sökväg, 'a' if lägg_till else 'w', encoding='utf-8',
+                      buffering=StandardLibrary.fil.buffert_storlek) as file:
+                file.writelines(str(rad) + '\n' for rad in rader)
+
+        @staticmethod
+        def mappa(sökväg):
+            return StandardLibrary.fil.Mappning(sökväg)
+
+        # The file is mapped into memory, so only the parts that are used are read from the disk
+        class Mappning:
+            def __init__(self, sökväg):
+                import mmap
+
+                with open(sökväg, 'rb') as file:
+                    self.data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+            def __len__(self):
+                return len(self.data)
+
+            def __getitem__(self, index):
+                if isinstance(index, slice):
+                    return self.data[index].decode('utf-8', errors='replace')
+                return chr(self.data[index])
+
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *_):
+                self.stäng()
+                return False
+
+            def sök(self, text, start=0):
+                return self.data.find(text.encode('utf-8'), start)
+
+            def räkna(self, text):
+                count = 0
+                index = self.data.find(text.encode('utf-8'))
+                while index != -1:
+                    count += 1
+                    index = self.data.find(text.encode('utf-8'), index + 1)
+                return count
+
+            def rader(self):
+                self.data.seek(0)
+                for line in iter(self.data.readline, b''):
+                    yield line.rstrip(b'\n').decode('utf-8', errors='replace')
+
+            def stäng(self):
+                self.data.close()
+
+    # The values are Python values, they're translated to Swedish when they're printed
+    class data:
+        @staticmethod
+        def csv_rader(sökväg, avgränsare=',', rubriker=False):
+            import csv
+
+            with open(sökväg, newline='', encoding='utf-8', buffering=StandardLibrary.fil.buffert_storlek) as file:
+                if rubriker:
+                    yield from csv.DictReader(file, delimiter=avgränsare)
+                else:
+                    yield from csv.reader(file, delimiter=avgränsare)
+
+        @staticmethod
+        def csv_skriv(sökväg, rader, avgränsare=','):
+            import csv
+
+            with open(sökväg, 'w', newline='', encoding='utf-8', buffering=StandardLibrary.fil.buffert_storlek) as file:
+                rader = iter(rader)
+                first_row = next(rader, None)
+                if first_row is None:
+                    return
+
+                # Lexikon rows are written with their keys as the header
+                if isinstance(first_row, dict):
+                    writer = csv.DictWriter(file, fieldnames=list(first_row), delimiter=avgränsare)
+                    writer.writeheader()
+                else:
+                    writer = csv.writer(file, delimiter=avgränsare)
+                writer.writerow(first_row)
+                writer.writerows(rader)
+
+        @staticmethod
+        def json_läs(sökväg):
+            with open(sökväg, encoding='utf-8') as file:
+                return json.load(file)
+
+        @staticmethod
+        def json_skriv(sökväg, värde):
+            with open(sökväg, 'w', encoding='utf-8') as file:
+                json.dump(värde, file, ensure_ascii=False)
+
+        @staticmethod
+        def jsonl_rader(sökväg):
+            decode = json.JSONDecoder().decode
+            for line in StandardLibrary.fil.rader(sökväg):
+                if line.strip():
+                    yield decode(line)
+
+        @staticmethod
+        def jsonl_skriv(sökväg, poster):
+            encode = json.JSONEncoder(ensure_ascii=False).encode
+            StandardLibrary.fil.skriv_alla(sökväg, (encode(post) for post in poster))
+
+    # The collections have Swedish names so that they're printed in Swedish, "till" and "bort" work on all of them
+    class samlingar:
+        # bort(0) takes the first value in constant time, a lista has to move all the other values
+        class kö(collections.deque):
+            lägg_först = collections.deque.appendleft
+            ta_först = collections.deque.popleft
+
+            def pop(self, index=-1):
+                if index == 0:
+                    return self.popleft()
+                if index == -1 or index == len(self) - 1:
+                    return super().pop()
+
+                value = self[index]
+                del self[index]
+                return value
+
+        class mängd(set):
+            append = set.add
+            ta_bort = set.discard
+
+            def pop(self, *värde):
+                if värde:
+                    self.remove(värde[0])
+                    return värde[0]
+                return super().pop()
+
+        class räknare(collections.Counter):
+            vanligast = collections.Counter.most_common
+
+            def append(self, värde):
+                self[värde] += 1
+
+        # Always gives the smallest value (or the value with the smallest priority) first
+        class prioritetskö:
+            def __init__(self, värden=()):
+                import heapq
+
+                # (priority, insertion number, value), values with the same priority come out in insertion order
+                self.heap = [(värde, number, värde) for number, värde in enumerate(värden)]
+                heapq.heapify(self.heap)
+                self.insertion_count = len(self.heap)
+
+            def lägg(self, värde, prioritet=None):
+                import heapq
+
+                heapq.heappush(self.heap, (värde if prioritet is None else prioritet, self.insertion_count, värde))
+                self.insertion_count += 1
+
+            def ta(self):
+                import heapq
+
+                return heapq.heappop(self.heap)[2]
+
+            def titta(self):
+                return self.heap[0][2]
+
+            append = lägg
+            pop = ta
+
+            def __len__(self):
+                return len(self.heap)
+
+            def __iter__(self):
+                return (value for _, _, value in sorted(self.heap))
+
+            def __repr__(self):
+                return 'prioritetskö(' + repr(list(self)) + ')'
+
+        @staticmethod
+        def topp(antal, lista, nyckel=None):
+            import heapq
+
+            return heapq.nlargest(antal, lista, key=nyckel)
+
+        @staticmethod
+        def botten(antal, lista, nyckel=None):
+            import heapq
+
+            return heapq.nsmallest(antal, lista, key=nyckel)
+
+    # A match is its text, or its groups when the pattern has groups
+    class mönster:
+        # The compiled patterns are shared by every call, minne.info(mönster.kompilera) shows how well it's used
+        @functools.lru_cache(maxsize=256)
+        def compile_pattern(mönster, ignorera_skiftläge=False):
+            return re.compile(mönster, re.IGNORECASE if ignorera_skiftläge else 0)
+
+        # An already compiled pattern is returned before the cache, so it doesn't take the place of a text pattern
+        def kompilera(mönster, ignorera_skiftläge=False):
+            if isinstance(mönster, re.Pattern):
+                return mönster
+            return StandardLibrary.mönster.compile_pattern(mönster, ignorera_skiftläge)
+
+        kompilera.cache_info = compile_pattern.cache_info
+        kompilera.cache_clear = compile_pattern.cache_clear
+        compile_pattern = staticmethod(compile_pattern)
+        kompilera = staticmethod(kompilera)
+
+        @staticmethod
+        def get_match_value(match):
+            groups = match.groups()
+            if not groups:
+                return match.group()
+            return groups[0] if len(groups) == 1 else list(groups)
+
+        @staticmethod
+        def hitta(mönster, text):
+            match = StandardLibrary.mönster.kompilera(mönster).search(text)
+            return StandardLibrary.mönster.get_match_value(match) if match else None
+
+        @staticmethod
+        def hitta_alla(mönster, text):
+            for match in StandardLibrary.mönster.kompilera(mönster).finditer(text):
+                yield StandardLibrary.mönster.get_match_value(match)
+
+        @staticmethod
+        def matchar(mönster, text):
+            return StandardLibrary.mönster.kompilera(mönster).search(text) is not None
+
+        @staticmethod
+        def ersätt(mönster, text, ersättning, antal=0):
+            return StandardLibrary.mönster.kompilera(mönster).sub(ersättning, text, count=antal)
+
+        @staticmethod
+        def dela(mönster, text, antal=0):
+            return StandardLibrary.mönster.kompilera(mönster).split(text, maxsplit=antal)
+
+    class minne:
+        @staticmethod
+        def rensa(funktion): funktion.cache_clear()
+
+        @staticmethod
+        def info(funktion):
+            info = funktion.cache_info()
+            return {'träffar': info.hits, 'missar': info.misses, 'storlek': info.currsize, 'maxstorlek': info.maxsize}
+
+
+class TokenKind:
+    names = (
+        'COMMENT',
+        'FUNCTION',
+        'VAR',
+        'STRING',
+        'PNUMBER',
+        'NNUMBER',
+        'IMPORT',
+        'EXTENSION',
+        'OPERATOR',
+        'LIST_START',
+        'LIST_END',
+        'START',
+        'END',
+        'KEYWORD',
+        'BOOL',
+        'USER_FUNCTION',
+        'USER_FUNCTION_CALL',
+        'OBJ_NOTATION',
+        'OBJ_NOTATION_PARAM',
+        'LAMBDA_CALL',
+        'MEMOIZE',
+        'COMPREHENSION_FOR',
+        'ASYNC',
+    )
+
+    # Every token kind is a small int, its index in names
+    COMMENT = 0
+    FUNCTION = 1
+    VAR = 2
+    STRING = 3
+    PNUMBER = 4
+    NNUMBER = 5
+    IMPORT = 6
+    EXTENSION = 7
+    OPERATOR = 8
+    LIST_START = 9
+    LIST_END = 10
+    START = 11
+    END = 12
+    KEYWORD = 13
+    BOOL = 14
+    USER_FUNCTION = 15
+    USER_FUNCTION_CALL = 16
+    OBJ_NOTATION = 17
+    OBJ_NOTATION_PARAM = 18
+    LAMBDA_CALL = 19
+    MEMOIZE = 20
+    COMPREHENSION_FOR = 21
+    ASYNC = 22
+
+
+class Token:
+    __slots__ = ('kind', 'value')
+
+    def __init__(self, kind, value):
+        self.kind = kind
+        self.value = value
+
+    # Compatibility view: a token can be read, compared and printed like the list [kind name, value]
+    def __getitem__(self, index):
+        if index == 0 or index == -2:
+            return TokenKind.names[self.kind]
+        if index == 1 or index == -1:
+            return self.value
+        raise IndexError('token index out of range')
+
+    def __setitem__(self, index, value):
+        if index == 0 or index == -2:
+            self.kind = TokenKind.names.index(value)
+        elif index == 1 or index == -1:
+            self.value = value
+        else:
+            raise IndexError('token index out of range')
+
+    def __len__(self):
+        return 2
+
+    def __iter__(self):
+        return iter((TokenKind.names[self.kind], self.value))
+
+    def __eq__(self, other):
+        if isinstance(other, Token):
+            return self.kind == other.kind and self.value == other.value
+        if isinstance(other, (list, tuple)):
+            return len(other) == 2 and TokenKind.names[self.kind] == other[0] and self.value == other[1]
+        return NotImplemented
+
+    def __repr__(self):
+        return repr([TokenKind.names[self.kind], self.value])
 
 
 class ErrorClass:
@@ -81,9 +553,6 @@ class ErrorClass:
         return ''
 
     def get_error_message_data(self):
-        if "module 'final_transpiled' has no attribute '__enkelt__'" in self.error:
-            return 'IGNORED'
-
         from googletrans import Translator
 
         translator = Translator()
@@ -94,17 +563,378 @@ class ErrorClass:
             self.set_error(self.error.replace("Traceback (most recent call last):", ''))
             self.set_error(self.error.replace('File "tmp.py", ', ''))
             self.set_error(self.error.replace(", in <module>", ''))
-            return translator.translate(self.error, dest='sv').text.replace('linje', 'rad').replace(
-                'final_transpiled.py, ', '')
+            return translator.translate(self.error, dest='sv').text.replace('linje', 'rad')
         else:
             # Get line number
             for index, item in enumerate(self.error_list):
                 if 'line' in item and has_numbers(self.error_list[index + 1]):
                     line_index = index + 1
-                    return error_type + " (vid rad " + str(int(self.error_list[line_index][:-1]) - 4) + ')'
+                    return error_type + " (vid rad " + str(int(self.error_list[line_index][:-1])) + ')'
             return error_type
 
 
+class ProfilerClass:
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.line_times = collections.defaultdict(float)
+        self.line_hits = collections.Counter()
+        self.current_line = None
+        self.last_time = time.perf_counter()
+
+    def trace(self, frame, event, arg):
+        now = time.perf_counter()
+
+        # The time since the last event is spent on the line that was running (calls to non-Enkelt code included)
+        if self.current_line is not None:
+            self.line_times[self.current_line] += now - self.last_time
+
+        if frame.f_code.co_filename != self.file_name:
+            self.last_time = time.perf_counter()
+            return None
+
+        if event == 'return':
+            caller = frame.f_back
+            if caller is not None and caller.f_code.co_filename == self.file_name:
+                self.current_line = (caller.f_lineno, caller.f_code.co_name)
+        elif event == 'call':
+            self.current_line = (frame.f_code.co_firstlineno, frame.f_code.co_name)
+        elif event == 'line':
+            self.current_line = (frame.f_lineno, frame.f_code.co_name)
+            self.line_hits[self.current_line] += 1
+
+        self.last_time = time.perf_counter()
+        return self.trace
+
+    def get_report(self, max_lines=20):
+        total_time = sum(self.line_times.values()) or 1
+        report = [
+            'Profilering av ' + self.file_name,
+            '{:>6} {:>12} {:>8} {:>10}  {}'.format('Rad', 'Tid (ms)', 'Andel', 'Körningar', 'Funktion')
+        ]
+
+        slowest_lines = sorted(self.line_times.items(), key=lambda item: item[1], reverse=True)[:max_lines]
+        for (line_number, function_name), line_time in slowest_lines:
+            report.append('{:>6} {:>12.3f} {:>7.1f}% {:>10}  {}'.format(
+                line_number,
+                line_time * 1000,
+                line_time / total_time * 100,
+                self.line_hits[(line_number, function_name)],
+                'huvudprogram' if function_name in ['<module>', '__enkelt__'] else function_name
+            ))
+
+        return '\n'.join(report)
+
+
+class MemoryProfilerClass:
+    # Only the newest frames of an allocation are needed to find its Enkelt line, and more frames cost more for every
+    # allocation (especially frames of big code objects, like Enkelt's own module code when it's run as a script)
+    def __init__(self, file_name, sample_interval=0.05, max_frames=5):
+        self.file_name = file_name
+        self.sample_interval = sample_interval
+        self.max_frames = max_frames
+
+        # (seconds since the start, traced bytes)
+        self.samples = []
+        self.peak_snapshot = None
+        self.peak_snapshot_size = 0
+        self.end_snapshot = None
+        self.traced_peak = 0
+        # tracemalloc's own memory, it's part of the RSS but not of the program
+        self.tracemalloc_memory = 0
+        self.peak_rss = None
+
+        self.is_running = False
+        self.sampler = None
+        self.start_time = 0
+
+    def start(self):
+        import tracemalloc
+        import threading
+
+        tracemalloc.start(self.max_frames)
+        self.start_time = time.perf_counter()
+        self.is_running = True
+        self.sampler = threading.Thread(target=self.sample, daemon=True)
+        self.sampler.start()
+
+    def sample(self):
+        import tracemalloc
+
+        while self.is_running:
+            self.take_sample(tracemalloc)
+            time.sleep(self.sample_interval)
+
+    def take_sample(self, tracemalloc):
+        traced_size = tracemalloc.get_traced_memory()[0]
+        self.samples.append((time.perf_counter() - self.start_time, traced_size))
+        self.tracemalloc_memory = max(self.tracemalloc_memory, tracemalloc.get_tracemalloc_memory())
+
+        # A snapshot takes time, so a new one is only taken when the memory has grown by a quarter. Memory that is
+        # freed between two samples is never in a snapshot, so the lines are from the largest sample, not the real peak
+        if traced_size > self.peak_snapshot_size * 1.25:
+            self.peak_snapshot = tracemalloc.take_snapshot()
+            self.peak_snapshot_size = traced_size
+
+    def stop(self):
+        import tracemalloc
+
+        self.is_running = False
+        self.sampler.join()
+
+        self.take_sample(tracemalloc)
+        # Before the end snapshot, which is a copy of every trace and would grow the RSS
+        self.peak_rss = self.get_peak_rss()
+        self.end_snapshot = tracemalloc.take_snapshot()
+        self.traced_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    # Enkelt line number -> [bytes, blocks], memory allocated outside of the program (ex. by Python) is on line 0
+    def get_line_sizes(self, snapshot):
+        line_sizes = collections.defaultdict(lambda: [0, 0])
+
+        # The traces are grouped by traceback first, going through every trace in Python takes seconds
+        for statistic in snapshot.statistics('traceback'):
+            line_number = 0
+            # The frames go from the oldest to the newest, the newest Enkelt line is the one that allocated
+            for frame in statistic.traceback:
+                if frame.filename == self.file_name:
+                    line_number = frame.lineno
+
+            line_sizes[line_number][0] += statistic.size
+            line_sizes[line_number][1] += statistic.count
+
+        return line_sizes
+
+    @staticmethod
+    def get_peak_rss():
+        try:
+            import resource
+        except ImportError:
+            return None
+
+        # Kilobytes on Linux, bytes on macOS
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak_rss if sys.platform == 'darwin' else peak_rss * 1024
+
+    # The highest RSS of the program without tracemalloc's own memory. tracemalloc's memory is the largest measured in
+    # a sample, so it's an estimate
+    def get_untraced_peak_rss(self):
+        if self.peak_rss is None:
+            return None
+
+        return max(0, self.peak_rss - self.tracemalloc_memory)
+
+    def get_data(self, max_lines=20):
+        peak_line_sizes = self.get_line_sizes(self.peak_snapshot or self.end_snapshot)
+        end_line_sizes = self.get_line_sizes(self.end_snapshot)
+
+        largest_lines = sorted(
+            (line_number for line_number in peak_line_sizes if line_number),
+            key=lambda line_number: peak_line_sizes[line_number][0],
+            reverse=True
+        )[:max_lines]
+
+        return {
+            'peak_rss': self.get_untraced_peak_rss(),
+            'tracemalloc_memory': self.tracemalloc_memory,
+            'traced_peak': self.traced_peak,
+            'lines': [
+                {
+                    'line': line_number,
+                    'bytes_at_largest_sample': peak_line_sizes[line_number][0],
+                    'blocks_at_largest_sample': peak_line_sizes[line_number][1],
+                    'bytes_at_end': end_line_sizes[line_number][0] if line_number in end_line_sizes else 0,
+                }
+                for line_number in largest_lines
+            ],
+            'outside_program_at_largest_sample': peak_line_sizes[0][0] if 0 in peak_line_sizes else 0,
+            'samples': [{'time': sample_time, 'bytes': traced_size} for sample_time, traced_size in self.samples],
+        }
+
+    def get_report(self, max_samples=10):
+        data = self.get_data()
+        peak_rss = data['peak_rss']
+        report = [
+            'Minnesprofilering av ' + self.file_name,
+            '{:<36} {:>12}'.format('Högsta RSS utan spårningen (kB, ca)', peak_rss // 1024 if peak_rss is not None else '-'),
+            '{:<36} {:>12}'.format('Spårningens eget minne (kB)', data['tracemalloc_memory'] // 1024),
+            '{:<36} {:>12}'.format('Högsta spårade minne (kB)', data['traced_peak'] // 1024),
+            '',
+            '{:>6} {:>26} {:>10} {:>16}'.format('Rad', 'Vid största mätningen (kB)', 'Block', 'Vid slutet (kB)'),
+        ]
+
+        for line in data['lines']:
+            report.append('{:>6} {:>26.1f} {:>10} {:>16.1f}'.format(
+                line['line'], line['bytes_at_largest_sample'] / 1024, line['blocks_at_largest_sample'],
+                line['bytes_at_end'] / 1024
+            ))
+        report.append('{:>6} {:>26.1f}'.format('Övrigt', data['outside_program_at_largest_sample'] / 1024))
+
+        # The growth over time, with at most max_samples evenly spread samples
+        samples = data['samples']
+        step = max(1, math.ceil(len(samples) / max_samples))
+        report.append('')
+        report.append('{:>10} {:>16}'.format('Tid (s)', 'Minne (kB)'))
+        for sample in samples[::step] + ([samples[-1]] if (len(samples) - 1) % step else []):
+            report.append('{:>10.2f} {:>16.1f}'.format(sample['time'], sample['bytes'] / 1024))
+
+        return '\n'.join(report)
+
+
+class StatisticsClass:
+    phases = [
+        ('fix_up_code_line', 'Förberedelse av rader'),
+        ('lex', 'Lexning'),
+        ('parse', 'Parsning'),
+        ('import_library', 'Import av bibliotek'),
+        ('fix_up_and_prepare_transpiled_code', 'Efterbehandling'),
+        ('compile', 'Kompilering'),
+        ('run_transpiled_code', 'Körning'),
+    ]
+
+    counter_names = [
+        ('lines', 'Rader'),
+        ('library_lines', 'Rader i bibliotek'),
+        ('tokens', 'Tokens'),
+        ('transpiled_lines', 'Transpilerade rader'),
+        ('imported_libraries', 'Importerade bibliotek'),
+        ('bytes_fetched', 'Hämtade bytes'),
+        ('cache_hits', 'Cacheträffar'),
+        ('bundled_libraries', 'Bibliotek ur biblioteksfilen'),
+    ]
+
+    def __init__(self):
+        self.phase_times = collections.OrderedDict((phase, 0.0) for phase, _ in self.phases)
+        self.counters = collections.Counter()
+        self.phase_stack = []
+        self.start_time = time.perf_counter()
+        self.phase_start_time = self.start_time
+
+    # Phases can be nested (for ex. an import while parsing), the time is only counted for the innermost phase.
+    def start(self, phase):
+        now = time.perf_counter()
+        if self.phase_stack:
+            self.phase_times[self.phase_stack[-1]] += now - self.phase_start_time
+        self.phase_stack.append(phase)
+        self.phase_start_time = now
+
+    def stop(self):
+        now = time.perf_counter()
+        self.phase_times[self.phase_stack.pop()] += now - self.phase_start_time
+        self.phase_start_time = now
+
+    def count(self, counter_name, amount=1):
+        self.counters[counter_name] += amount
+
+    def get_data(self):
+        return {
+            'total_time': time.perf_counter() - self.start_time,
+            'phase_times': dict(self.phase_times),
+            'counters': {counter_name: self.counters[counter_name] for counter_name, _ in self.counter_names}
+        }
+
+    def get_report(self):
+        data = self.get_data()
+        report = ['Statistik', '{:<28} {:>12}'.format('Fas', 'Tid (ms)')]
+
+        for phase, phase_name in self.phases:
+            report.append('{:<28} {:>12.3f}'.format(phase_name, data['phase_times'][phase] * 1000))
+        report.append('{:<28} {:>12.3f}'.format('Totalt', data['total_time'] * 1000))
+
+        report.append('')
+        for counter_name, swedish_counter_name in self.counter_names:
+            report.append('{:<28} {:>12}'.format(swedish_counter_name, data['counters'][counter_name]))
+
+        return '\n'.join(report)
+
+
+# All installed libraries (bib/) in one file, that's read through a single mmap:
+#   magic | length of the index (8 bytes) | index (JSON) | the libraries' Enkelt code and pre-transpiled Python
+class LibraryBundleClass:
+    magic = b'ENKELTBIB1'
+    index_length_size = 8
+
+    def __init__(self, path):
+        import mmap
+
+        with open(path, 'rb') as bundle_file:
+            self.data = mmap.mmap(bundle_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        header_length = len(self.magic) + self.index_length_size
+        if self.data[:len(self.magic)] != self.magic:
+            self.data.close()
+            raise ValueError('Filen ' + path + ' är ingen biblioteksfil')
+
+        index_length = int.from_bytes(self.data[len(self.magic):header_length], 'little')
+        index = json.loads(self.data[header_length:header_length + index_length])
+
+        self.data_start = header_length + index_length
+        # Bundles written before the fingerprint was added don't have one, their code is always transpiled again
+        self.transpiler_fingerprint = index.get('transpilerare')
+        # Library name -> offsets, hashes, and the functions & libraries that transpiling the library adds
+        self.libraries = index['bibliotek']
+
+    # part is 'källa' (the Enkelt code) or 'python' (the pre-transpiled code)
+    def read(self, library_name, part):
+        import hashlib
+
+        start, length = self.libraries[library_name][part]
+        content = self.data[self.data_start + start:self.data_start + start + length]
+
+        if hashlib.sha256(content).hexdigest() != self.libraries[library_name]['sha256'][part]:
+            raise ValueError('Biblioteket ' + library_name + ' i biblioteksfilen är skadat')
+
+        return content.decode('utf-8')
+
+    def close(self):
+        self.data.close()
+
+    # libraries: library name -> a dictionary from get_bundle_entry()
+    @classmethod
+    def write(cls, path, libraries):
+        import hashlib
+        import tempfile
+
+        index = {'enkelt': version, 'transpilerare': get_transpiler_fingerprint(), 'bibliotek': {}}
+        contents = []
+        offset = 0
+
+        for library_name, library in libraries.items():
+            entry = {
+                'funktioner': library['funktioner'],
+                'importerar': library['importerar'],
+                'sha256': {},
+            }
+            for part in ['källa', 'python']:
+                # A library without pre-transpiled code is transpiled from its Enkelt code
+                if library[part] is None:
+                    continue
+                content = library[part].encode('utf-8')
+                entry[part] = [offset, len(content)]
+                entry['sha256'][part] = hashlib.sha256(content).hexdigest()
+                contents.append(content)
+                offset += len(content)
+            index['bibliotek'][library_name] = entry
+
+        index = json.dumps(index, ensure_ascii=False).encode('utf-8')
+
+        # Written next to the old file and then renamed, so a running program never sees half a file
+        bundle_fd, temporary_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+        try:
+            with os.fdopen(bundle_fd, 'wb') as bundle_file:
+                bundle_file.write(cls.magic)
+                bundle_file.write(len(index).to_bytes(cls.index_length_size, 'little'))
+                bundle_file.write(index)
+                for content in contents:
+                    bundle_file.write(content)
+                bundle_file.flush()
+                os.fsync(bundle_file.fileno())
+            os.replace(temporary_path, path)
+        except BaseException:
+            os.remove(temporary_path)
+            raise
+
+
 # ############################################### #
 # Modules Used When Executing The Transpiled Code #
 # ############################################### #
@@ -127,13 +957,89 @@ def enkelt_input(prompt=''):
             return str(tmp)
 
 
+# Reads one line and returns the number on it, or None if it isn't a number
+def enkelt_input_number(prompt=''):
+    number = convert_input(input(prompt) if prompt else sys.stdin.readline())
+
+    return number if not isinstance(number, str) else None
+
+
+# Reads one line of numbers (or texts), separated by spaces or commas
+def enkelt_input_list(prompt=''):
+    line = input(prompt) if prompt else sys.stdin.readline()
+
+    return [convert_input(part) for part in input_separator_pattern.split(line) if part]
+
+
+# Reads everything that's left on stdin, one line at a time.
+# sys.stdin (not sys.stdin.buffer) is used, since in() & in_tal() may already have buffered the next lines there.
+def enkelt_input_all():
+    for line in sys.stdin:
+        yield convert_input(line)
+
+
+# Used by in_tal(), in_lista() & in_alla(). The regexes find the usual numbers without raising exceptions,
+# int() & float() still get the rest (ex. "1_000" & "inf") so that the same numbers as in in() are accepted.
+def convert_input(text):
+    text = text.strip()
+
+    # The patterns accept what int() and float() accept
+    if integer_input_pattern.fullmatch(text):
+        # int() has a limit on the number of digits, a longer number is kept as text
+        max_digits = get_int_max_str_digits()
+        return int(text) if not 0 < max_digits < len(text.lstrip('+-').replace('_', '')) else text
+    if float_input_pattern.fullmatch(text):
+        return float(text)
+
+    return text
+
+
+def enkelt_read_lines(path, mode='r'):
+    with open(path, mode) as file:
+        for line in file:
+            yield line.rstrip('\n')
+
+
+# Ex. 1500000 -> '1,500 ms'
+def format_duration(nanoseconds):
+    for unit, unit_size in [('s', 10 ** 9), ('ms', 10 ** 6), ('µs', 10 ** 3)]:
+        if nanoseconds >= unit_size:
+            return '{:.3f} {}'.format(nanoseconds / unit_size, unit).replace('.', ',')
+
+    return str(nanoseconds) + ' ns'
+
+
+# Used by "minne def", caches the function's return values for up to max_size different arguments
+def enkelt_memoize(max_size=None):
+    return functools.lru_cache(maxsize=default_memoize_size if max_size is None else max_size)
+
+
 # ############ #
 # Main Methods #
 # ############ #
 
+# The Swedish names of the Python types that the samlingar collections are built on
+collection_type_names = {collections.deque: 'kö', set: 'mängd', collections.Counter: 'räknare'}
+
+
 def translate_output_to_swedish(data):
     if isinstance(data, collections.abc.KeysView):
         data = list(data)
+    # The type of a samlingar collection is printed as its Swedish name, ex. kö
+    if isinstance(data, type) and data.__qualname__.startswith('StandardLibrary.samlingar.'):
+        return data.__name__
+    if isinstance(data, type) and data in collection_type_names:
+        return collection_type_names[data]
+    # A compiled pattern is printed as the mönster.kompilera call that gives it
+    if isinstance(data, re.Pattern):
+        return 'mönster.kompilera(' + repr(data.pattern) + (', Sant' if data.flags & re.IGNORECASE else '') + ')'
+    # Operations on samlingar collections can give back the Python types, ex. räknare + räknare is a Counter
+    if type(data) is collections.deque:
+        data = StandardLibrary.samlingar.kö(data, data.maxlen)
+    elif type(data) is collections.Counter:
+        data = StandardLibrary.samlingar.räknare(data)
+    elif type(data) is set and not data:
+        return 'mängd()'
 
     replace_dict = {
         "True": 'Sant',
@@ -176,13 +1082,25 @@ def check_for_updates(version_nr):
 
 def get_functions_from_lexed_library_code(data, library_name):
     for token_index, _ in enumerate(data):
-        if data[token_index][0] == 'USER_FUNCTION':
-            data[token_index][1] = library_name + '.' + data[token_index][1]
+        if data[token_index].kind == TokenKind.USER_FUNCTION:
+            data[token_index].value = library_name + '.' + data[token_index].value
             user_functions[-1] = library_name + '.' + user_functions[-1]
 
     return data
 
 
+# Runs func(*args), and times it as the phase when --statistik is used
+def run_phase(phase, func, *args):
+    if statistics is None:
+        return func(*args)
+
+    statistics.start(phase)
+    try:
+        return func(*args)
+    finally:
+        statistics.stop()
+
+
 def transpile_library_code(library_code, library_name):
     global final
     global source_code
@@ -190,15 +1108,19 @@ def transpile_library_code(library_code, library_name):
 
     for line in library_code:
         if line != '\n':
-            data = fix_up_code_line(line)
-            data = lex(data)
+            if statistics is not None:
+                statistics.count('library_lines')
+            data = run_phase('fix_up_code_line', fix_up_code_line, line)
+            data = run_phase('lex', lex, data)
+            if statistics is not None:
+                statistics.count('tokens', len(data))
 
             data = get_functions_from_lexed_library_code(data, library_name)
 
             if is_extension:
                 source_code.append(line)
             else:
-                parse(data, 0)
+                source_code = [run_phase('parse', parse_line, data)]
 
             if is_developer_mode:
                 print('--DEV: transpile_library_code, line')
@@ -233,33 +1155,154 @@ def get_import(file_or_code, is_file, library_name):
 
 def load_library_from_remote(url, library_name):
     response = urllib.request.urlopen(url)
-    library_code = response.read().decode('utf-8')
+    library_code = response.read()
 
-    library_code = library_code.split('\n')
+    if statistics is not None:
+        statistics.count('bytes_fetched', len(library_code))
+
+    library_code = library_code.decode('utf-8').split('\n')
 
     get_import(library_code, False, library_name)
 
 
+# Transpiles a library like an import in an empty program would, for LibraryBundleClass.write()
+# bundle_sources is the Enkelt code of every library in the bundle being written (library name -> code), the libraries
+# that the library imports are transpiled from it, they're never fetched from the web
+def get_bundle_entry(library_name, library_code, bundle_sources=None):
+    global is_offline
+    global library_sources
+    global skipped_remote_libraries
+
+    reset_transpiler_state()
+    was_offline = is_offline
+    is_offline = True
+    library_sources = bundle_sources or {}
+    skipped_remote_libraries = []
+    try:
+        get_import(library_code.split('\n'), False, library_name)
+
+        entry = {
+            'källa': library_code,
+            'python': ''.join(final),
+            'funktioner': list(user_functions),
+            'importerar': imported_libraries[1:],
+        }
+
+        # A library that imports a library from the web only has its Enkelt code, it's transpiled when it's imported
+        if skipped_remote_libraries:
+            entry.update(python=None, funktioner=[], importerar=[])
+    finally:
+        is_offline = was_offline
+        library_sources = {}
+        skipped_remote_libraries = []
+        reset_transpiler_state()
+
+    return entry
+
+
+# The hash of this file, the pre-transpiled code in a bundle is only used by the transpiler that wrote it.
+# The version number isn't enough, since it isn't changed by every change to the generated code.
+def get_transpiler_fingerprint():
+    global transpiler_fingerprint
+
+    if transpiler_fingerprint is None:
+        import hashlib
+
+        with open(__file__, 'rb') as transpiler_file:
+            transpiler_fingerprint = hashlib.sha256(transpiler_file.read()).hexdigest()
+
+    return transpiler_fingerprint
+
+
+def get_library_bundle():
+    global library_bundle
+
+    # The bundle is opened once per process
+    if library_bundle is None:
+        try:
+            library_bundle = LibraryBundleClass(library_bundle_path)
+        except (OSError, ValueError):
+            library_bundle = False
+
+    return library_bundle or None
+
+
+def import_library_from_bundle(bundle, library_name):
+    global source_code
+
+    library = bundle.libraries[library_name]
+
+    if statistics is not None:
+        statistics.count('bundled_libraries')
+
+    # The libraries imported by the library are a part of its pre-transpiled code, so it can only be used
+    # when none of them has been imported already (and when it was transpiled by this transpiler)
+    if 'python' not in library or bundle.transpiler_fingerprint != get_transpiler_fingerprint() or is_extension or \
+            any(imported_library in imported_libraries for imported_library in library['importerar']):
+        get_import(bundle.read(library_name, 'källa').split('\n'), False, library_name)
+        return
+
+    imported_libraries.append(library_name)
+    imported_libraries.extend(library['importerar'])
+    user_functions.extend(library['funktioner'])
+
+    final.append(bundle.read(library_name, 'python'))
+    source_code = []
+
+
 def import_library(library_name):
+    global imported_libraries
+
+    # A library that already has been imported doesn't need to be transpiled again.
+    if library_name in imported_libraries:
+        if statistics is not None:
+            statistics.count('cache_hits')
+        return
+
+    if statistics is not None:
+        statistics.count('imported_libraries')
+        statistics.start('import_library')
+        try:
+            find_and_import_library(library_name)
+        finally:
+            statistics.stop()
+    else:
+        find_and_import_library(library_name)
+
+
+def find_and_import_library(library_name):
     from urllib.error import HTTPError
 
     global enkelt_script_path
     global web_import_location
 
+    global imported_files
+
+    # The library is in the bundle that's being written
+    if library_name in library_sources:
+        get_import(library_sources[library_name].split('\n'), False, library_name)
+        return
+
     # Checks if the library is user-made (i.e. local not remote).
-    import_file = ''.join(enkelt_script_path.split('/')[:-1]) + '/' + library_name + '.e'
+    import_file = os.path.join(os.path.dirname(enkelt_script_path), library_name + '.e')
 
     if os.path.isfile(import_file):
+        imported_files.add(import_file)
         get_import(import_file, True, library_name)
         return
 
     # The library might be a local extension (.epy file)
     import_file += 'py'
     if os.path.isfile(import_file):
+        imported_files.add(import_file)
         get_import(import_file, True, library_name)
 
-    # The library might be remote (i.e. needs to be fetched)
-    else:
+    # The library might be installed with lib.py
+    elif get_library_bundle() is not None and library_name in library_bundle.libraries:
+        import_library_from_bundle(library_bundle, library_name)
+
+    # The library might be remote (i.e. needs to be fetched), unless libraries aren't fetched at all
+    elif not is_offline:
         url = web_import_location + library_name + '.e'
 
         try:
@@ -272,6 +1315,8 @@ def import_library(library_name):
                 load_library_from_remote(url, library_name)
             except HTTPError:
                 print('Det inträffade ett fel!! Kunde inte importera ' + library_name)
+    else:
+        skipped_remote_libraries.append(library_name)
 
 
 def translate_clear():
@@ -296,12 +1341,17 @@ def get_errors():
     }
 
 
+# The tables are built once, the lexer looks names up in them for almost every character. They're never changed.
+@functools.lru_cache(maxsize=None)
 def functions_keywords_and_obj_notations():
     return {
         'functions': {
             # Functions with no statuses in parse()
             'skriv': 'print',
             'in': 'input',
+            'in_tal': 'input_number',
+            'in_lista': 'input_list',
+            'in_alla': 'input_all',
             'Sträng': 'str',
             'Heltal': 'int',
             'Decimal': 'float',
@@ -359,6 +1409,8 @@ def functions_keywords_and_obj_notations():
             'sekund': 'second',
             'mikrosekund': 'microsecond',
             'global': 'global ',
+            'ge': 'yield ',
+            'vänta': 'await ',
             'om': ' if ',
             'annars': ' else '
         },
@@ -366,13 +1418,14 @@ def functions_keywords_and_obj_notations():
             'klass': 'class ',
             'försök': 'try',
             'fånga': 'except Exception as ',
-            'slutligen': 'finally'
+            'slutligen': 'finally',
+            'tidtagning': 'with Enkelt.StandardLibrary.tid.tidtagning'
         }
     }
 
 
 def get_obj_notations():
-    return ['klass', 'försök', 'fånga']
+    return ['klass', 'försök', 'fånga', 'tidtagning']
 
 
 def translate_operator(operator):
@@ -400,6 +1453,17 @@ def translate_function(func):
     return function_translations[func] if func in function_translations.keys() else 'error'
 
 
+def translate_library_function(name):
+    library = name.split('.')[0]
+
+    # The function is part of the standard library
+    if library in standard_library:
+        return 'Enkelt.StandardLibrary.' + library + '.' + ''.join(name.split('.')[1:])
+
+    # The function is an imported function
+    return name.replace('.', '__enkelt__')
+
+
 def transpile_function(func):
     global source_code
 
@@ -439,159 +1503,191 @@ def parse(lexed, token_index):
 
     global standard_library
 
+    global is_console_mode
+
     forbidden = forbidden_variable_names()
 
-    global is_console_mode
+    # Parses the tokens one by one, from token_index to the end of the line
+    for token_index in range(token_index, len(lexed)):
+        token_kind = lexed[token_index].kind
+        token_val = lexed[token_index].value
 
-    is_comment = False
-
-    token_type = str(lexed[token_index][0])
-    token_val = lexed[token_index][1]
-
-    needs_start = needs_start_statuses[-1]
-
-    if indent_layers and token_index == 0:
-        for _ in indent_layers:
-            source_code.append('\t')
-    if token_type == 'COMMENT':
-        source_code.append(token_val)
-        is_comment = True
-    elif token_type == 'FUNCTION':
-        # Specific functions & function cases that ex. required updating of statuses.
-        if token_val == 'skriv' or token_val == 'in':
-            tmp = ''
-            if not is_console_mode:
-                tmp = 'Enkelt.enkelt_'
-            source_code.append(tmp + 'print(' if token_val == 'skriv' else tmp + 'input(')
-        elif token_val == 'om' or token_val == 'anom':
-            source_code.append(translate_function(token_val) + ' ')
-            is_if = True
-        elif token_val == 'öppna':
-            transpile_function(token_val)
-            needs_start_statuses.append(True)
-            is_file_open = True
-        elif token_val == 'för' or token_val == 'medan':
-            source_code.append(translate_function(token_val) + ' ')
-            look_for_loop_ending = True
-            if token_val == 'för':
-                is_for = True
-        elif token_val == 'töm':
-            source_code.append(translate_function(token_val))
-        # Every other function get's transpiled in the same way.
-        else:
-            transpile_function(token_val)
-    elif token_type == 'VAR':
-        if token_val not in forbidden:
-            source_code.append(token_val)
-        elif token_val == 'själv':
-            source_code.append('self')
-        else:
-            print('Det inträffade ett fel! namnet ' + token_val + " är inte tillåtet som variabelnamn!")
-    elif token_type == 'STRING':
-        if is_file_open and len(token_val) <= 2:
-            token_val = token_val.replace('l', 'r').replace('ö', 'w')
-        source_code.append('"' + token_val + '"')
-    elif token_type == 'PNUMBER' or token_type == 'NNUMBER':
-        source_code.append(token_val)
-    elif token_type == 'IMPORT' or token_type == 'EXTENSION':
-        if token_type == 'EXTENSION':
-            is_extension = True
-        import_library(token_val)
-    elif token_type == 'OPERATOR':
-        # Special operator cases
-        if is_if and token_val == ')':
-            is_if = False
-            needs_start_statuses.append(True)
-        elif is_math and token_val == ')':
-            is_math = False
-        elif look_for_loop_ending and token_val == ')':
-            look_for_loop_ending = False
-            needs_start_statuses.append(True)
-        elif token_val == '>' and lexed[token_index-1][1] == '=' and lexed[token_index+1][0] == 'USER_FUNCTION_CALL':
-            lambda_num += 1
-            if lexed[token_index-2][0] != 'VAR':
-                source_code = source_code[:-1]
-            source_code.append('lambda ')
-        elif lambda_num and token_val == ')':
-            source_code.append(': ')
-        elif token_val in ['&', '|', '!']:
-            to_translate = token_val
-
-            # Checks if the ! is part of a != expression
-            if token_val == '!' and token_index+1 < len(lexed):
-                if lexed[token_index+1][1] == '=':
-                    to_translate = 'not'
-
-            source_code.append(translate_operator(to_translate))
-        # All other operators just gets appended to the source
-        else:
+        needs_start = needs_start_statuses[-1]
+
+        if indent_layers and token_index == 0:
+            for _ in indent_layers:
+                source_code.append('\t')
+        if token_kind == TokenKind.COMMENT:
             source_code.append(token_val)
-    elif token_type == 'LIST_START' or token_type == 'LIST_END':
-        source_code.append(token_val)
-    elif token_type == 'START':
-        if not lambda_num:
-            if not needs_start:
+            break
+        elif token_kind == TokenKind.FUNCTION:
+            # Specific functions & function cases that ex. required updating of statuses.
+            if token_val == 'skriv' or token_val == 'in':
+                tmp = ''
+                if not is_console_mode:
+                    tmp = 'Enkelt.enkelt_'
+                source_code.append(tmp + 'print(' if token_val == 'skriv' else tmp + 'input(')
+            elif token_val in ['in_tal', 'in_lista', 'in_alla']:
+                # These have no Python builtin to use in the console mode
+                source_code.append('Enkelt.enkelt_' + translate_function(token_val) + '(')
+            elif token_val == 'om' or token_val == 'anom':
+                source_code.append(translate_function(token_val) + ' ')
+                is_if = True
+            elif token_val == 'öppna':
+                if token_index == 0:
+                    transpile_function(token_val)
+                    needs_start_statuses.append(True)
+                else:
+                    # Used as a value, ex. "för ($rad; inom öppna("fil.txt")) {", the lines are read one at a time
+                    source_code.append('Enkelt.enkelt_read_lines(')
+                is_file_open = True
+            elif token_val == 'för' or token_val == 'medan':
+                source_code.append(translate_function(token_val) + ' ')
+                look_for_loop_ending = True
+                if token_val == 'för':
+                    is_for = True
+            elif token_val == 'töm':
+                source_code.append(translate_function(token_val))
+            # Every other function get's transpiled in the same way.
+            else:
+                transpile_function(token_val)
+        elif token_kind == TokenKind.VAR:
+            if token_val not in forbidden:
+                # A library function passed as a value, ex. "minne.info(mönster.kompilera)"
+                if '.' in token_val:
+                    token_val = translate_library_function(token_val)
                 source_code.append(token_val)
-            elif len(lexed) - 1 == token_index:
-                source_code.append(':')
+            elif token_val == 'själv':
+                source_code.append('self')
             else:
-                source_code.append(':' + '\n')
-            if needs_start:
-                indent_layers.append("x")
-    elif token_type == 'END':
-        if lambda_num:
-            lambda_num -= 1
-        elif not needs_start:
+                print('Det inträffade ett fel! namnet ' + token_val + " är inte tillåtet som variabelnamn!")
+        elif token_kind == TokenKind.STRING:
+            if is_file_open and len(token_val) <= 2:
+                token_val = token_val.replace('l', 'r').replace('ö', 'w')
+            source_code.append('"' + token_val + '"')
+        elif token_kind == TokenKind.PNUMBER or token_kind == TokenKind.NNUMBER:
             source_code.append(token_val)
-        else:
-            needs_start_statuses.pop(-1)
-            indent_layers.pop(-1)
-            if len(lexed) - 1 != token_index:
-                source_code.append('\n')
-                for _ in indent_layers:
-                    source_code.append('\t')
-    elif token_type == 'KEYWORD' or token_type == 'BOOL':
-        # Specific keywords & keyword cases that ex. required updating of statuses.
-        if token_val == 'annars':
-            source_code.append(translate_keyword(token_val))
-            needs_start_statuses.append(True)
-        # Every other keyword get's transpiled in the same way.
-        else:
-            transpile_keyword(token_val)
-    elif token_type == 'USER_FUNCTION':
-        # Needed when functions are imported functions
-        token_val = token_val.replace('.', '__enkelt__')
-        source_code.append('def ' + token_val + '(')
-        needs_start_statuses.append(True)
-    elif token_type == 'USER_FUNCTION_CALL' and not lambda_num:
-        if '.' in token_val:
-            if token_val.split('.')[0] in standard_library:
-                # The function is part of the standard library
-                library = token_val.split('.')[0]
-                rest = ''.join(token_val.split('.')[1:])
-
-                token_val = 'Enkelt.StandardLibrary.' + library + '.' + rest
+        elif token_kind == TokenKind.IMPORT or token_kind == TokenKind.EXTENSION:
+            if token_kind == TokenKind.EXTENSION:
+                is_extension = True
+            import_library(token_val)
+        elif token_kind == TokenKind.OPERATOR:
+            # Special operator cases
+            if is_if and token_val == ')':
+                is_if = False
+                needs_start_statuses.append(True)
+            elif is_math and token_val == ')':
+                is_math = False
+            elif look_for_loop_ending and token_val == ')':
+                look_for_loop_ending = False
+                needs_start_statuses.append(True)
+            elif token_val == '>' and lexed[token_index-1].value == '=' and \
+                    lexed[token_index+1].kind == TokenKind.USER_FUNCTION_CALL:
+                lambda_num += 1
+                if lexed[token_index-2].kind != TokenKind.VAR:
+                    source_code = source_code[:-1]
+                source_code.append('lambda ')
+            elif lambda_num and token_val == ')':
+                source_code.append(': ')
+            elif token_val in ['&', '|', '!']:
+                to_translate = token_val
+
+                # Checks if the ! is part of a != expression
+                if token_val == '!' and token_index+1 < len(lexed):
+                    if lexed[token_index+1].value == '=':
+                        to_translate = 'not'
+
+                source_code.append(translate_operator(to_translate))
+            # All other operators just gets appended to the source
             else:
-                # Function is an imported functions
-                token_val = token_val.replace('.', '__enkelt__')
-        source_code.append(token_val + '(')
-    elif token_type == 'OBJ_NOTATION':
-        source_code.append(translate_obj_notation(token_val))
-        needs_start_statuses.append(True)
-    elif token_type == 'OBJ_NOTATION_PARAM':
-        source_code.append(' ' + token_val)
-        needs_start_statuses.append(True)
-    elif token_type == 'LAMBDA_CALL':
-        source_code.append(token_val)
-
-    # Recursively calls parse() when there is more code to parse
-    if len(lexed) - 1 >= token_index + 1 and not is_comment:
-        parse(lexed, token_index + 1)
+                source_code.append(token_val)
+        elif token_kind == TokenKind.LIST_START or token_kind == TokenKind.LIST_END:
+            source_code.append(token_val)
+        elif token_kind == TokenKind.START:
+            if not lambda_num:
+                if not needs_start:
+                    source_code.append(token_val)
+                elif len(lexed) - 1 == token_index:
+                    source_code.append(':')
+                else:
+                    source_code.append(':' + '\n')
+                if needs_start:
+                    indent_layers.append("x")
+        elif token_kind == TokenKind.END:
+            if lambda_num:
+                lambda_num -= 1
+            elif not needs_start:
+                source_code.append(token_val)
+            else:
+                needs_start_statuses.pop(-1)
+                indent_layers.pop(-1)
+                if len(lexed) - 1 != token_index:
+                    source_code.append('\n')
+                    for _ in indent_layers:
+                        source_code.append('\t')
+        elif token_kind == TokenKind.KEYWORD or token_kind == TokenKind.BOOL:
+            # Specific keywords & keyword cases that ex. required updating of statuses.
+            # "annars {" starts a block, "1 om $a annars 2" is an inline if
+            if token_val == 'annars' and (token_index == 0 or lexed[token_index - 1].kind == TokenKind.END):
+                source_code.append(translate_keyword(token_val).strip())
+                needs_start_statuses.append(True)
+            # Every other keyword get's transpiled in the same way.
+            else:
+                transpile_keyword(token_val)
+        elif token_kind == TokenKind.COMPREHENSION_FOR:
+            source_code.append(' for ')
+        elif token_kind == TokenKind.ASYNC:
+            source_code.append('async ')
+        elif token_kind == TokenKind.MEMOIZE:
+            # The decorator get's its own line, the def follows on the next one with the same indentation
+            source_code.append('@Enkelt.enkelt_memoize(' + token_val + ')\n' + '\t' * len(indent_layers))
+        elif token_kind == TokenKind.USER_FUNCTION:
+            # Needed when functions are imported functions
+            token_val = token_val.replace('.', '__enkelt__')
+            source_code.append('def ' + token_val + '(')
+            needs_start_statuses.append(True)
+        elif token_kind == TokenKind.USER_FUNCTION_CALL and not lambda_num:
+            if '.' in token_val:
+                token_val = translate_library_function(token_val)
+            source_code.append(token_val + '(')
+        elif token_kind == TokenKind.OBJ_NOTATION:
+            source_code.append(translate_obj_notation(token_val))
+            needs_start_statuses.append(True)
+        elif token_kind == TokenKind.OBJ_NOTATION_PARAM:
+            source_code.append(' ' + token_val)
+            needs_start_statuses.append(True)
+        elif token_kind == TokenKind.LAMBDA_CALL:
+            source_code.append(token_val)
+
+
+# Checks if a keyword, ex. "om", is the start of a longer name, ex. "om(", "området(" or the user function "omvänd("
+def is_start_of_longer_name(line, chr_index, word):
+    if line.startswith('(', chr_index + 1) and translate_function(word) != 'error':
+        return True
+
+    translations = functions_keywords_and_obj_notations()
+
+    # Every longer name is a start of the name characters that follow, so only those are looked up
+    following_name = name_characters_pattern.match(line, chr_index + 1 - len(word)).group()
+    for name_end in range(len(word) + 1, len(following_name) + 1):
+        name = following_name[:name_end]
+        if name in translations['functions'] or name in translations['keywords'] or name in user_functions:
+            return True
+
+    return False
+
+
+def is_word_keyword(line, chr_index, word):
+    # "ge" and "vänta" are only keywords as whole words, so that ex. "genomsnitt(" isn't "ge nomsnitt("
+    if word not in ('ge', 'vänta'):
+        return True
+
+    return word_keyword_end_pattern.match(line, chr_index + 1) is not None
 
 
 def lex(line):
     if line[0] == '#':
-        return ['COMMENT', line]
+        return [Token(TokenKind.COMMENT, line)]
 
     global user_functions
     global imported_libraries
@@ -607,59 +1703,69 @@ def lex(line):
     is_obj_notation = False
     is_import = False
     is_extension_mode = False
+    is_comprehension_target = False
+    is_comprehension_iterable = False
     lexed_data = []
     last_action = ''
     might_be_negative_num = False
     data_index = -1
     op_dict = {
-        '=': 'OPERATOR',
-        '[': 'LIST_START',
-        ']': 'LIST_END',
-        '{': 'START',
-        '}': 'END',
-        '(': 'LAMBDA_CALL'
+        '=': TokenKind.OPERATOR,
+        '[': TokenKind.LIST_START,
+        ']': TokenKind.LIST_END,
+        '{': TokenKind.START,
+        '}': TokenKind.END,
+        '(': TokenKind.LAMBDA_CALL
     }
-    op_dict.update({key:'OPERATOR' for key in operators})
+    op_dict.update({key: TokenKind.OPERATOR for key in operators})
+
+    next_chr_index = 0
 
     for chr_index, char in enumerate(line):
+        # Skips characters that have already been lexed by looking ahead, ex. the size in "minne(256)def"
+        if chr_index < next_chr_index:
+            continue
         if is_import and char != ' ':
             tmp_data += char
         if is_import and chr_index == len(line) - 1:
-            lexed_data.append(['IMPORT' if not is_extension_mode else 'EXTENSION', tmp_data])
+            lexed_data.append(Token(TokenKind.IMPORT if not is_extension_mode else TokenKind.EXTENSION, tmp_data))
             is_import = False
             is_extension_mode = False
             tmp_data = ''
         if is_function and char not in operators and char != '(':
             tmp_data += char
         elif is_function and char == '(':
-            lexed_data.append(['USER_FUNCTION', tmp_data])
+            lexed_data.append(Token(TokenKind.USER_FUNCTION, sys.intern(tmp_data)))
             user_functions.append(tmp_data)
             tmp_data = ''
             is_function = False
         elif char == '{' and not is_var:
             if is_obj_notation:
-                lexed_data.append(['OBJ_NOTATION_PARAM', tmp_data])
+                lexed_data.append(Token(TokenKind.OBJ_NOTATION_PARAM, tmp_data))
                 tmp_data = ''
                 is_obj_notation = False
-            lexed_data.append(['START', char])
+            lexed_data.append(Token(TokenKind.START, char))
         elif char == '}' and not is_var:
-            lexed_data.append(['END', char])
+            if not is_string and is_function_value(tmp_data):
+                lexed_data.append(Token(TokenKind.VAR, sys.intern(tmp_data)))
+                tmp_data = ''
+            lexed_data.append(Token(TokenKind.END, char))
         elif char == '#' and not is_string:
             break
         elif char.isdigit() and not is_string and not is_var:
             if might_be_negative_num or last_action == 'NNUMBER':
                 if last_action == 'NNUMBER':
-                    lexed_data[data_index - 1] = ['NNUMBER', lexed_data[data_index - 1][1] + char]
+                    lexed_data[data_index - 1] = Token(TokenKind.NNUMBER, lexed_data[data_index - 1].value + char)
                 else:
-                    lexed_data.append(['NNUMBER', '-' + char])
+                    lexed_data.append(Token(TokenKind.NNUMBER, '-' + char))
                     data_index += 1
                 last_action = 'NNUMBER'
                 might_be_negative_num = False
             else:
                 if last_action == 'PNUMBER':
-                    lexed_data[-1] = ['PNUMBER', lexed_data[-1][1] + char]
+                    lexed_data[-1].value += char
                 else:
-                    lexed_data.append(['PNUMBER', char])
+                    lexed_data.append(Token(TokenKind.PNUMBER, char))
                     data_index += 1
 
                 last_action = 'PNUMBER'
@@ -672,133 +1778,466 @@ def lex(line):
                 tmp_data = ''
             elif char == '"' and is_string:
                 is_string = False
-                lexed_data.append(['STRING', tmp_data])
+                lexed_data.append(Token(TokenKind.STRING, tmp_data))
                 tmp_data = ''
             elif is_string:
                 tmp_data += char
             else:
                 if char == '[' and not is_var:
-                    lexed_data.append(['LIST_START', '['])
+                    lexed_data.append(Token(TokenKind.LIST_START, '['))
                 elif char == ']' and not is_var:
-                    lexed_data.append(['LIST_END', ']'])
+                    if is_function_value(tmp_data):
+                        lexed_data.append(Token(TokenKind.VAR, sys.intern(tmp_data)))
+                        tmp_data = ''
+                    lexed_data.append(Token(TokenKind.LIST_END, ']'))
                 else:
                     if char == '$':
                         is_var = True
                         tmp_data = ''
                     elif is_var:
-                        if char in operators + list(' =[]{}('):
+                        # The spaces are gone, so in "[$x*2för$xinom$listaom$x>0]" the comprehension's
+                        # för, inom and om are found at the end of the var names
+                        var_name = tmp_data + char
+                        if var_name.endswith('för') and line.startswith('$', chr_index + 1):
                             is_var = False
-                            lexed_data.append(['VAR', tmp_data])
+                            is_comprehension_target = True
+                            lexed_data.append(Token(TokenKind.VAR, sys.intern(var_name[:-len('för')])))
+                            lexed_data.append(Token(TokenKind.COMPREHENSION_FOR, 'för'))
+                            tmp_data = ''
+                        elif is_comprehension_target and var_name.endswith('inom'):
+                            is_var = False
+                            is_comprehension_target = False
+                            is_comprehension_iterable = True
+                            lexed_data.append(Token(TokenKind.VAR, var_name[:-len('inom')] + ' '))
+                            lexed_data.append(Token(TokenKind.KEYWORD, 'inom'))
+                            tmp_data = ''
+                        elif is_comprehension_iterable and var_name.endswith('om') and \
+                                line.startswith(comprehension_condition_starts, chr_index + 1):
+                            is_var = False
+                            is_comprehension_iterable = False
+                            lexed_data.append(Token(TokenKind.VAR, sys.intern(var_name[:-len('om')])))
+                            lexed_data.append(Token(TokenKind.KEYWORD, 'om'))
+                            tmp_data = ''
+                        elif char in operators + list(' =[]{}('):
+                            is_var = False
+                            is_comprehension_iterable = False
+                            lexed_data.append(Token(TokenKind.VAR, sys.intern(tmp_data)))
                             if char != ';':
-                                lexed_data.append([op_dict[char], char])
+                                lexed_data.append(Token(op_dict[char], char))
                             else:
-                                lexed_data[-1][-1] = tmp_data + ' '
+                                lexed_data[-1].value = tmp_data + ' '
                             tmp_data = ''
                         else:
                             tmp_data += char
                             if len(line) - 1 == chr_index:
                                 is_var = False
-                                lexed_data.append(['VAR', tmp_data])
+                                lexed_data.append(Token(TokenKind.VAR, sys.intern(tmp_data)))
                                 tmp_data = ''
                     elif char in operators and tmp_data not in imported_libraries and tmp_data not in standard_library:
-                        lexed_data.append(['OPERATOR', char])
+                        if is_function_value(tmp_data):
+                            lexed_data.append(Token(TokenKind.VAR, sys.intern(tmp_data)))
+                            tmp_data = ''
+                        lexed_data.append(Token(TokenKind.OPERATOR, char))
                     elif char in imported_libraries or char in standard_library and char != '.':
-                        lexed_data.append(['OPERATOR', char])
+                        lexed_data.append(Token(TokenKind.OPERATOR, char))
                     elif char in imported_libraries or char in standard_library and char == '.':
                         tmp_data += char
                     else:
                         if tmp_data == 'Sant' or tmp_data == 'Falskt':
-                            lexed_data.append(['BOOL', tmp_data])
+                            lexed_data.append(Token(TokenKind.BOOL, sys.intern(tmp_data)))
                             tmp_data = ''
                         else:
                             if char == '(' and translate_function(tmp_data) != 'error':
-                                lexed_data.append(['FUNCTION', tmp_data])
+                                lexed_data.append(Token(TokenKind.FUNCTION, sys.intern(tmp_data)))
                                 tmp_data = ''
                             elif char == '(' and tmp_data in user_functions or char == '(' and translate_function(
                                     tmp_data) == 'error':
-                                lexed_data.append(['USER_FUNCTION_CALL', tmp_data])
+                                lexed_data.append(Token(TokenKind.USER_FUNCTION_CALL, sys.intern(tmp_data)))
                                 tmp_data = ''
                             else:
                                 if not is_import:
                                     tmp_data += char
                                 if tmp_data == 'Sant' or tmp_data == 'Falskt':
-                                    lexed_data.append(['BOOL', tmp_data])
+                                    lexed_data.append(Token(TokenKind.BOOL, sys.intern(tmp_data)))
                                     tmp_data = ''
                                 else:
-                                    if translate_keyword(tmp_data) != 'error':
-                                        lexed_data.append(['KEYWORD', tmp_data])
+                                    if translate_keyword(tmp_data) != 'error' and \
+                                            not is_start_of_longer_name(line, chr_index, tmp_data) and \
+                                            is_word_keyword(line, chr_index, tmp_data):
+                                        lexed_data.append(Token(TokenKind.KEYWORD, sys.intern(tmp_data)))
+                                        # Skips the space kept after "ge" and "vänta"
+                                        if line.startswith(' ', chr_index + 1):
+                                            next_chr_index = chr_index + 2
                                         tmp_data = ''
                                     elif tmp_data == 'def':
                                         is_function = True
                                         tmp_data = ''
+                                    elif tmp_data == 'asynk' and line.startswith('def', chr_index + 1):
+                                        lexed_data.append(Token(TokenKind.ASYNC, 'asynk'))
+                                        tmp_data = ''
+                                    elif tmp_data == 'för' and line.startswith('$', chr_index + 1):
+                                        # The för of a comprehension, ex. "[$x*2för$xinom$lista]"
+                                        lexed_data.append(Token(TokenKind.COMPREHENSION_FOR, 'för'))
+                                        is_comprehension_target = True
+                                        tmp_data = ''
+                                    elif tmp_data == 'minne' and memoize_modifier_pattern.match(line, chr_index + 1):
+                                        memoize_modifier = memoize_modifier_pattern.match(line, chr_index + 1)
+                                        lexed_data.append(Token(TokenKind.MEMOIZE, memoize_modifier.group(1) or ''))
+                                        # Continues lexing from the "def"
+                                        next_chr_index = memoize_modifier.end() - 3
+                                        tmp_data = ''
                                     elif tmp_data == 'importera' or tmp_data == 'utöka':
                                         is_import = True
                                         is_extension_mode = True if (tmp_data == 'utöka') else False
                                         tmp_data = ''
                                     elif tmp_data in obj_notations:
-                                        lexed_data.append(['OBJ_NOTATION', tmp_data])
+                                        lexed_data.append(Token(TokenKind.OBJ_NOTATION, tmp_data))
                                         tmp_data = ''
                                         is_obj_notation = True
 
+    # A function value at the end of the line, ex. "$f = mönster.hitta"
+    if not is_string and not is_import and is_function_value(tmp_data):
+        lexed_data.append(Token(TokenKind.VAR, sys.intern(tmp_data)))
+
     return lexed_data
 
 
+# A function that isn't called, ex. "minne.info(fib)" or "[mönster.hitta]", is passed as a value
+def is_function_value(name):
+    if not name:
+        return False
+    if name in user_functions:
+        return True
+
+    library = name.split('.')[0]
+    return '.' in name and (library in standard_library or library in imported_libraries)
+
+
+# The characters of function & keyword names
+name_characters_pattern = re.compile(r'[\w.]*')
+# Matches what follows "minne" in "minnedef" or "minne(256)def", the group is the cache size
+memoize_modifier_pattern = re.compile(r'(?:\((\d*)\))?def')
+# What the condition of a comprehension can start with, ex. "$x" in "[$x för $x inom $lista om $x > 0]"
+comprehension_condition_starts = ('$', '!', '(', '"', 'Sant', 'Falskt')
+# Digits with single underscores in between, ex. "1_000"
+integer_input_pattern = re.compile(r'[-+]?\d(?:_?\d)*')
+float_input_pattern = re.compile(
+    r'[-+]?(?:(?:(?:\d(?:_?\d)*)?\.\d(?:_?\d)*|\d(?:_?\d)*\.?)(?:e[-+]?\d(?:_?\d)*)?|inf(?:inity)?|nan)',
+    re.IGNORECASE
+)
+# sys.get_int_max_str_digits() is new in Python 3.11, the limit is 0 when there's none
+get_int_max_str_digits = getattr(sys, 'get_int_max_str_digits', lambda: 0)
+input_separator_pattern = re.compile(r'[\s,]+')
+# Removes newlines and turns single quotes into double quotes
+code_line_translation = str.maketrans({'\n': None, "'": '"'})
+# Matches "importera" at the start of a line, no matter the spaces in between the letters
+import_keyword_pattern = re.compile(r' *i *m *p *o *r *t *e *r *a')
+# "ge" and "vänta" as whole words followed by a space, the one space is kept so that "ge nomsnitt()" and
+# "genomsnitt()" aren't lexed the same
+word_keyword_pattern = re.compile(r'(?<![\w$.])(ge|vänta)\s+')
+# What "ge" and "vänta" can be followed by when there isn't a space in between, ex. "ge$x" or "vänta(...)"
+word_keyword_end_pattern = re.compile(r'[ $\d"(\[{-]|$')
+
+
 def fix_up_code_line(statement):
     global is_extension
 
-    statement = statement.replace('\n', '')\
-                         .replace("'", '"')\
+    statement = statement.translate(code_line_translation)\
                          .replace('\\"', '|-ENKELT_ESCAPED_QUOTE-|')\
                          .replace('\\', '|-ENKELT_ESCAPED_BACKSLASH-|')
     if not is_extension:
         statement = statement.replace('\t', '')
 
-    current_line = ''
-    is_string = False
-    is_import = False
+    # Imports keep their spaces after the import keyword
+    import_keyword = import_keyword_pattern.match(statement)
+    if import_keyword:
+        return 'importera' + statement[import_keyword.end():]
+
+    # Every other part is outside of a string, that's where the spaces are removed
+    parts = statement.split('"')
+    parts[::2] = [
+        word_keyword_pattern.sub(r'\1|-ENKELT_SPACE-|', part).replace(' ', '').replace('|-ENKELT_SPACE-|', ' ')
+        for part in parts[::2]
+    ]
+
+    return '"'.join(parts)
 
-    for char in statement:
-        if char == ' ' and not is_string and not is_import:
-            continue
-        elif char == '"':
-            is_string = not is_string
-        current_line += char
 
-        if current_line == 'importera':
-            is_import = True
+def fix_up_transpiled_line(transpiled):
+    # Keeps the leading tabs (indentation) of every generated line and turns the remaining tabs into spaces.
+    # The number of lines is never changed, so every generated line still maps to its Enkelt line.
+    fixed_lines = []
 
-    return current_line
+    for line in transpiled.split('\n'):
+        indentation = len(line) - len(line.lstrip('\t'))
+        fixed_lines.append('\t' * indentation + line[indentation:].lstrip(' \t').replace('\t', ' '))
+
+    return '\n'.join(fixed_lines)
 
 
 def fix_up_and_prepare_transpiled_code():
     global final
 
-    # Removes unnecessary tabs
-    for line_index, line in enumerate(final):
-        tmp_line = list(line)
-        chars_started = False
-        for char_index, char in enumerate(tmp_line):
-            if char != '\t' and char != '\n' and not chars_started:
-                chars_started = True
-            elif chars_started and char == '\t' and char_index > 0:
-                tmp_line[char_index] = ' '
+    # Fixes escaped (\) characters
+    code = ''.join(final)
+    code = code.replace('|-ENKELT_ESCAPED_QUOTE-|', '\\"').replace('|-ENKELT_ESCAPED_BACKSLASH-|', '\\')
 
-        final[line_index] = ''.join(tmp_line)
+    return code
 
-    # Turn = = into == and ! = into != and + = into +=
-    final = list(''.join(final).replace('= =', '==').replace('! =', '==').replace('+ =', '+='))
 
-    # Fixes escaped (\) characters
-    final = list(
-        ''.join(final).replace('|-ENKELT_ESCAPED_QUOTE-|', '\\"').replace('|-ENKELT_ESCAPED_BACKSLASH-|', '\\')
-    )
+def map_transpiled_lines():
+    global final
+    global final_line_numbers
 
-    # Remove empty lines from final
-    final = list(re.sub(r'\n\s*\n', '\n\n', ''.join(final)))
+    # line_map[generated line number] -> Enkelt line number
+    line_map = [0]
+    starts_new_line = True
 
-    code = ''.join(final)
+    for fragment, line_number in zip(final, final_line_numbers):
+        if not fragment:
+            continue
+        if starts_new_line:
+            line_map.append(line_number)
+        line_map.extend([line_number] * fragment[:-1].count('\n'))
+        starts_new_line = fragment.endswith('\n')
+
+    return line_map
+
+
+def get_transpiled_code_file_name():
+    global enkelt_script_path
+
+    return enkelt_script_path if enkelt_script_path and not is_console_mode else '<enkelt>'
+
+
+def compile_transpiled_code(code):
+    file_name = get_transpiled_code_file_name()
+    line_map = map_transpiled_lines()
+
+    def to_enkelt_line(generated_line):
+        return line_map[generated_line] if generated_line and generated_line < len(line_map) else generated_line
+
+    try:
+        tree = ast.parse(code, file_name)
+    except SyntaxError as err:
+        err.lineno = to_enkelt_line(err.lineno)
+        raise
+
+    # Gives every node the line number of the Enkelt line it was transpiled from.
+    # Statements that only span generated lines with the same number as their Enkelt line are left as they are.
+    for statement in tree.body:
+        end_lineno = getattr(statement, 'end_lineno', None) or len(line_map)
+        if all(to_enkelt_line(line) == line for line in range(statement.lineno, end_lineno + 1)):
+            continue
+
+        for node in ast.walk(statement):
+            if 'lineno' in node._attributes:
+                node.lineno = to_enkelt_line(node.lineno)
+                if getattr(node, 'end_lineno', None) is not None:
+                    node.end_lineno = max(node.lineno, to_enkelt_line(node.end_lineno))
+
+    # In the function that wraps the program "ge" would make the program a generator that never runs
+    if 'yield' in code:
+        top_level_yield = find_top_level_yield(tree)
+        if top_level_yield is not None:
+            raise SyntaxError(
+                '"ge" kan bara användas i en funktion',
+                (file_name, top_level_yield.lineno, top_level_yield.col_offset + 1, None)
+            )
+
+    if is_fast_locals_mode:
+        tree = wrap_program_in_function(tree, code, file_name)
+
+    # "vänta" is allowed outside of functions, execute_compiled_code() then runs the program in an event loop
+    return compile(tree, file_name, 'exec', flags=ast.PyCF_ALLOW_TOP_LEVEL_AWAIT)
+
+
+def can_be_wrapped_in_function(statements):
+    for statement in statements:
+        if isinstance(statement, ast.Return):
+            return False
+        if isinstance(statement, ast.ImportFrom) and any(alias.name == '*' for alias in statement.names):
+            return False
+        if isinstance(statement, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            continue
+
+        for field in ['body', 'orelse', 'finalbody', 'handlers', 'cases']:
+            if not can_be_wrapped_in_function(getattr(statement, field, [])):
+                return False
+
+    return True
+
+
+def get_program_global_names(code, file_name):
+    import symtable
+
+    module_table = symtable.symtable(code, file_name, 'exec')
+
+    # Names the program itself binds (variables, functions, classes & imports)
+    bound_names = set()
+    namespace_names = set()
+    for symbol in module_table.get_symbols():
+        if symbol.is_namespace():
+            namespace_names.add(symbol.get_name())
+        if symbol.is_assigned() or symbol.is_imported() or symbol.is_namespace():
+            bound_names.add(symbol.get_name())
+
+    # Names that functions, lambdas & classes read or write as globals.
+    # Comprehensions can use the locals of the wrapping function (as closures), so they're skipped.
+    shared_names = set()
+    tables = module_table.get_children()
+    while tables:
+        table = tables.pop()
+        tables.extend(table.get_children())
+        if table.get_name() in ['listcomp', 'setcomp', 'dictcomp', 'genexpr']:
+            continue
+
+        for symbol in table.get_symbols():
+            if symbol.is_global():
+                shared_names.add(symbol.get_name())
+
+    # Functions & classes are always global so that they keep a real (for ex. picklable) name
+    return sorted(namespace_names | (shared_names & bound_names))
+
+
+def needs_event_loop(node):
+    for child in ast.iter_child_nodes(node):
+        if isinstance(child, (ast.Await, ast.AsyncFor, ast.AsyncWith)):
+            return True
+        # Awaits inside functions run in the event loop of whoever calls the function
+        if not isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef, ast.Lambda, ast.ClassDef)) and \
+                needs_event_loop(child):
+            return True
+
+    return False
+
+
+def find_top_level_yield(node):
+    for child in ast.iter_child_nodes(node):
+        if isinstance(child, (ast.Yield, ast.YieldFrom)):
+            return child
+        if not isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef, ast.Lambda)):
+            top_level_yield = find_top_level_yield(child)
+            if top_level_yield is not None:
+                return top_level_yield
+
+    return None
+
+
+def wrap_program_in_function(tree, code, file_name):
+    # Runs the program inside a function so that its variables are fast locals instead of dictionary globals.
+    # Only the names that are shared with user functions & classes are declared global.
+    if not tree.body or not can_be_wrapped_in_function(tree.body):
+        return tree
+
+    if needs_event_loop(tree):
+        wrapped_tree = ast.parse('async def __enkelt__():\n\tpass\nawait __enkelt__()\n')
+    else:
+        wrapped_tree = ast.parse('def __enkelt__():\n\tpass\n__enkelt__()\n')
+    wrapper = wrapped_tree.body[0]
+    wrapper.body = tree.body
+
+    global_names = get_program_global_names(code, file_name)
+    if global_names:
+        wrapper.body.insert(0, ast.parse('global ' + ', '.join(global_names)).body[0])
+
+    return wrapped_tree
+
+
+def get_enkelt_line_number(err):
+    file_name = get_transpiled_code_file_name()
+    line_number = 0
+
+    traceback = err.__traceback__
+    while traceback is not None:
+        if traceback.tb_frame.f_code.co_filename == file_name:
+            line_number = traceback.tb_lineno
+        traceback = traceback.tb_next
+
+    return line_number
+
+
+def get_program_namespace():
+    # The program runs in a real module, so that its functions can be pickled, ex. by parallell.karta
+    program_module = types.ModuleType('__enkelt__')
+    program_module.Enkelt = sys.modules[__name__]
+    sys.modules['__enkelt__'] = program_module
+
+    return program_module.__dict__
+
+
+# inspect.CO_COROUTINE, inspect is slow to import
+CO_COROUTINE = 0x80
+
+
+def execute_compiled_code(compiled, namespace):
+    # Programs that use "vänta" outside of functions are compiled into a coroutine
+    if compiled.co_flags & CO_COROUTINE:
+        import asyncio
+
+        asyncio.run(eval(compiled, namespace))
+    else:
+        exec(compiled, namespace)
+
+
+def profile_transpiled_code(compiled, namespace):
+    global profile_output_path
+
+    # Writes function level pstats data (for ex. snakeviz or flameprof) when a file is given
+    if profile_output_path:
+        import cProfile
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            execute_compiled_code(compiled, namespace)
+        finally:
+            profiler.disable()
+            profiler.dump_stats(profile_output_path)
+            print('Profileringsdata sparades i ' + profile_output_path)
+    # Otherwise the time is attributed to every Enkelt line and printed as a report
+    else:
+        profiler = ProfilerClass(get_transpiled_code_file_name())
+        sys.settrace(profiler.trace)
+        try:
+            execute_compiled_code(compiled, namespace)
+        finally:
+            sys.settrace(None)
+            print(profiler.get_report())
+
+
+def memory_profile_transpiled_code(compiled, namespace):
+    global memory_profile_output_path
+
+    profiler = MemoryProfilerClass(get_transpiled_code_file_name())
+    profiler.start()
+    try:
+        execute_compiled_code(compiled, namespace)
+    finally:
+        # Also when the program runs out of memory, that's when the report is needed the most
+        profiler.stop()
+
+        if memory_profile_output_path:
+            with open(memory_profile_output_path, 'w', encoding='utf-8') as profile_file:
+                json.dump(profiler.get_data(), profile_file, indent=4)
+            print('Minnesprofileringen sparades i ' + memory_profile_output_path)
+        else:
+            print(profiler.get_report())
 
-    return code
+
+def print_program_error(err):
+    if is_developer_mode:
+        print('--DEV: run_transpiled_code, error')
+        print(err)
+
+    error_message = str(err).replace('(<string>, ', '(')
+    line_number = get_enkelt_line_number(err)
+    if line_number and not isinstance(err, SyntaxError):
+        error_message += ' (line ' + str(line_number) + ')'
+
+    # Print out error(s) if any
+    error = ErrorClass(error_message)
+    print(error.get_error_message_data())
 
 
 def run_transpiled_code():
@@ -806,78 +2245,147 @@ def run_transpiled_code():
     global is_developer_mode
     global is_console_mode
 
-    if not is_console_mode:
-        # Inserts necessary code to make importing a temporary python file work.
-        code_to_append = """import enkelt as Enkelt\ndef __enkelt__():\n\tprint('', end='')\n"""
-        final.insert(0, code_to_append)
-
+    if statistics is not None:
+        statistics.start('fix_up_and_prepare_transpiled_code')
     code = fix_up_and_prepare_transpiled_code()
+    if statistics is not None:
+        statistics.stop()
+        statistics.count('transpiled_lines', code.count('\n'))
 
     if is_developer_mode:
         print('--DEV: run_transpiled_code, final code')
         print(code)
 
-    if not is_console_mode:
-        # Writes the transpiled code to a file temporarily.
-        with open('final_transpiled.py', 'w+', encoding='utf-8') as transpiled_f:
-            transpiled_f.writelines(code)
-
-    # Executes the code transpiled to python and catches Exceptions
+    # Compiles the transpiled code and executes it, catching Exceptions
     try:
-        # The "main" way of executing the transpiled code
-        if not is_console_mode:
-            # This line will show an error;
-            # it's importing a temporary file that get's created (and deleted) by this script.
-            import final_transpiled
-            final_transpiled.__enkelt__()
-        # The "fallback"/console execution process.
+        if statistics is not None:
+            statistics.start('compile')
+        compiled = compile_transpiled_code(code)
+        if statistics is not None:
+            statistics.stop()
+            statistics.start('run_transpiled_code')
+
+        if is_profiling_mode:
+            profile_transpiled_code(compiled, get_program_namespace())
+        elif is_memory_profiling_mode:
+            memory_profile_transpiled_code(compiled, get_program_namespace())
         else:
-            exec(code)
+            execute_compiled_code(compiled, get_program_namespace())
     except Exception as err:
-        if is_developer_mode:
-            if str(err) != 'module \'final_transpiled\' has no attribute \'__enkelt__\'':
-                print('--DEV: run_final_transpiled_code, error')
-                print(err)
-
-        # Print out error(s) if any
-        error = ErrorClass(str(err).replace('(<string>, ', '('))
-        if error.get_error_message_data() != 'IGNORED':
-            print(error.get_error_message_data())
+        print_program_error(err)
+        return False
+    finally:
+        if statistics is not None and statistics.phase_stack:
+            statistics.stop()
 
-    if not is_console_mode:
-        # Removes the temporary python file.
-        with open('final_transpiled.py', 'w+', encoding='utf-8') as transpiled_f:
-            transpiled_f.writelines('')
-        os.remove(os.getcwd() + '/final_transpiled.py')
+    return True
 
 
-def transpile_line(line):
+def transpile_line(line, line_number=0):
     global source_code
     global is_developer_mode
     global final
+    global final_line_numbers
 
     if line != '\n':
         if is_developer_mode:
             print('--DEV: transpile_line, line')
             print(line)
 
-        data = fix_up_code_line(line)
-        data = lex(data)
+        # In watch mode a line that is unchanged, and transpiled in the same state as before, is reused from the cache
+        if transpiled_line_cache is not None:
+            cache_key = (line, get_transpiler_state())
+            if cache_key in transpiled_line_cache:
+                transpiled_line_cache.move_to_end(cache_key)
+                transpiled_fragments, transpiler_state = transpiled_line_cache[cache_key]
+                final.extend(transpiled_fragments)
+                set_transpiler_state(transpiler_state)
+                final_line_numbers.extend([line_number] * (len(final) - len(final_line_numbers)))
+                return
+            first_fragment_index = len(final)
+
+        if statistics is not None:
+            statistics.count('lines')
+        data = run_phase('fix_up_code_line', fix_up_code_line, line)
+        data = run_phase('lex', lex, data)
+        if statistics is not None:
+            statistics.count('tokens', len(data))
 
         if is_developer_mode:
             print('--DEV: transpile_line, lexed line')
             print(data)
 
-        parse(data, 0)
-
         # Appends the transpiled code to the final source code
-        final.append(''.join(source_code))
+        final.append(run_phase('parse', parse_line, data))
+        final.append('\n')
+
+        # Everything added to the final source code (including imported libraries) comes from this line
+        final_line_numbers.extend([line_number] * (len(final) - len(final_line_numbers)))
+
+        if transpiled_line_cache is not None:
+            transpiled_line_cache[cache_key] = (final[first_fragment_index:], get_transpiler_state())
+            # The lines used least recently are removed first, the lines of the current run are used last
+            while len(transpiled_line_cache) > transpiled_line_cache_size:
+                transpiled_line_cache.popitem(last=False)
+    else:
+        # Empty lines are kept so that the generated lines keep the numbers of the Enkelt lines
         final.append('\n')
-        source_code = []
+        final_line_numbers.append(line_number)
+
+
+# The Python code parse() writes for the line
+def parse_line(lexed):
+    global source_code
+
+    parse(lexed, 0)
+    transpiled = fix_up_transpiled_line(''.join(source_code))
+    source_code = []
+
+    return transpiled
+
+
+def get_transpiler_state():
+    # Everything lex() and parse() read from or leave behind between lines
+    return (
+        is_if,
+        is_math,
+        is_for,
+        look_for_loop_ending,
+        tuple(needs_start_statuses),
+        is_file_open,
+        is_extension,
+        lambda_num,
+        len(indent_layers),
+        tuple(imported_libraries),
+        tuple(user_functions),
+    )
+
+
+def set_transpiler_state(transpiler_state):
+    global is_if
+    global is_math
+    global is_for
+    global look_for_loop_ending
+    global needs_start_statuses
+    global is_file_open
+    global is_extension
+    global lambda_num
+    global indent_layers
+    global imported_libraries
+    global user_functions
+
+    is_if, is_math, is_for, look_for_loop_ending, needs_start_statuses, is_file_open, is_extension, lambda_num, \
+        indent_layers, imported_libraries, user_functions = transpiler_state
+
+    needs_start_statuses = list(needs_start_statuses)
+    indent_layers = ['x'] * indent_layers
+    imported_libraries = list(imported_libraries)
+    user_functions = list(user_functions)
 
 
 def prepare_and_run_code_lines_to_be_run(code):
     global final
+    global final_line_numbers
     global variables
 
     # Removes empty lines
@@ -888,12 +2396,13 @@ def prepare_and_run_code_lines_to_be_run(code):
     if variables:
         for var in variables[::-1]:
             final.insert(0, var + '\n')
+            final_line_numbers.insert(0, 0)
 
     # Runs the code line by line
-    for line_to_run in code:
-        transpile_line(line_to_run)
+    for line_number, line_to_run in enumerate(code, 1):
+        transpile_line(line_to_run, line_number)
 
-    run_transpiled_code()
+    return run_transpiled_code()
 
 
 def console_mode(first):
@@ -901,6 +2410,7 @@ def console_mode(first):
     global variables
     global source_code
     global final
+    global final_line_numbers
     global is_console_mode
 
     is_console_mode = True
@@ -917,7 +2427,7 @@ def console_mode(first):
         tmp_lexed_code_line_to_test_if_var = lex(tmp_lexed_code_line_to_test_if_var)
 
         # Makes sure that the line is a "normal" code line, i.e. not the clear command and not a variable declaration.
-        if code_line.replace(' (', '(') != 'töm()' and tmp_lexed_code_line_to_test_if_var[0][0] != 'VAR':
+        if code_line.replace(' (', '(') != 'töm()' and tmp_lexed_code_line_to_test_if_var[0].kind != TokenKind.VAR:
             prepare_and_run_code_lines_to_be_run([code_line])
 
         # Clear command was issued
@@ -935,9 +2445,412 @@ def console_mode(first):
     # Calling the console, recursively
     source_code = []
     final = []
+    final_line_numbers = []
     console_mode(False)
 
 
+def get_modification_times(file_paths):
+    modification_times = {}
+
+    for file_path in file_paths:
+        try:
+            modification_times[file_path] = os.stat(file_path).st_mtime_ns
+        except OSError:
+            modification_times[file_path] = None
+
+    return modification_times
+
+
+def watch_mode(poll_interval=0.1):
+    global transpiled_line_cache
+    global transpiled_line_cache_size
+    global imported_files
+    global enkelt_script_path
+
+    transpiled_line_cache = collections.OrderedDict()
+
+    try:
+        while True:
+            with open(enkelt_script_path, encoding='utf-8') as script_file:
+                code_lines = script_file.readlines()
+
+            # Room for every line of the script and as many old ones, ex. the lines after an added block, which
+            # are transpiled again with another indentation
+            transpiled_line_cache_size = max(2 * len(code_lines), 1000)
+
+            start_time = time.perf_counter()
+            reset_transpiler_state()
+            prepare_and_run_code_lines_to_be_run(code_lines)
+            print('--- Körningen tog {:.1f} ms, väntar på ändringar (Ctrl+C för att avsluta) ---'.format(
+                (time.perf_counter() - start_time) * 1000
+            ))
+
+            # Polls the script and its local imports until one of them changes
+            watched_files = [enkelt_script_path] + sorted(imported_files)
+            modification_times = get_modification_times(watched_files)
+            while True:
+                time.sleep(poll_interval)
+                new_modification_times = get_modification_times(watched_files)
+                if new_modification_times != modification_times:
+                    break
+
+            # Cached lines that import a changed library would otherwise keep the old library code
+            changed_files = [
+                file_path for file_path in watched_files
+                if new_modification_times[file_path] != modification_times[file_path]
+            ]
+            if changed_files != [enkelt_script_path]:
+                transpiled_line_cache.clear()
+    except KeyboardInterrupt:
+        print()
+    finally:
+        transpiled_line_cache = None
+
+
+def run_for_each_input(input_path):
+    import io
+    import contextlib
+
+    output = io.StringIO()
+    exit_code = 0
+    start_time = time.perf_counter()
+
+    # The input is the program's stdin (for in(), in_tal() & in_alla()) and its argument
+    with contextlib.redirect_stdout(output):
+        stdin, argv = sys.stdin, sys.argv
+        try:
+            with open(input_path, encoding='utf-8') as input_file:
+                sys.stdin = input_file
+                sys.argv = [enkelt_script_path, input_path]
+                execute_compiled_code(for_each_compiled, get_program_namespace())
+        except FileNotFoundError:
+            print('Filen ' + input_path + ' kunde inte hittas!')
+            exit_code = 1
+        except SystemExit as err:
+            # exit() only ends the run of this input, the code is recorded like the exit status of a program
+            if err.code is None or isinstance(err.code, int):
+                exit_code = err.code or 0
+            else:
+                print(err.code)
+                exit_code = 1
+        except Exception as err:
+            print_program_error(err)
+            exit_code = 1
+        finally:
+            sys.stdin, sys.argv = stdin, argv
+
+    return exit_code, output.getvalue(), time.perf_counter() - start_time
+
+
+def for_each_mode(code_lines):
+    import multiprocessing
+    import concurrent.futures
+
+    global for_each_compiled
+
+    # The script is transpiled & compiled once, and then run with a new namespace for every input
+    for line_number, line in enumerate(code_lines, 1):
+        transpile_line(line, line_number)
+    try:
+        for_each_compiled = compile_transpiled_code(fix_up_and_prepare_transpiled_code())
+    except Exception as err:
+        print_program_error(err)
+        return False
+
+    workers = for_each_workers or os.cpu_count() or 1
+    # The workers are forked after the compile, so they already have the compiled program
+    if workers > 1 and len(for_each_inputs) > 1 and 'fork' in multiprocessing.get_all_start_methods():
+        executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('fork')
+        )
+        results = executor.map(
+            run_for_each_input,
+            for_each_inputs,
+            chunksize=max(1, len(for_each_inputs) // (workers * 4))
+        )
+    else:
+        executor = None
+        results = map(run_for_each_input, for_each_inputs)
+
+    collected_results = []
+    try:
+        # The results are printed in the order of the inputs, as soon as they're ready
+        for input_path, (exit_code, output, duration) in zip(for_each_inputs, results):
+            is_ok = exit_code == 0
+            collected_results.append({
+                'input': input_path, 'ok': is_ok, 'exit_code': exit_code, 'output': output, 'time': duration
+            })
+
+            if not for_each_results_path:
+                print('==> ' + input_path + (' (fel)' if not is_ok else '') + ' <==')
+                print(output, end='' if output.endswith('\n') or not output else '\n')
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+    failed_count = sum(1 for result in collected_results if not result['ok'])
+    if for_each_results_path:
+        with open(for_each_results_path, 'w', encoding='utf-8') as results_file:
+            json.dump(collected_results, results_file, indent=4, ensure_ascii=False)
+        print('Resultaten sparades i ' + for_each_results_path)
+    print('{} körningar, {} med fel, {:.1f} ms'.format(
+        len(collected_results), failed_count, sum(result['time'] for result in collected_results) * 1000
+    ))
+
+    return failed_count == 0
+
+
+# The installed libraries of every directory that the service has run scripts in, they're read once by the service and
+# the workers get them already opened. Bundle path -> ((inode, modification time), bundle)
+service_library_bundles = {}
+
+
+def get_service_library_bundle(directory):
+    bundle_path = os.path.abspath(os.path.join(directory, library_bundle_path))
+    try:
+        bundle_status = os.stat(bundle_path)
+    except OSError:
+        return None
+
+    # lib.py writes a new file and renames it, so a changed bundle has another inode
+    bundle_key = (bundle_status.st_ino, bundle_status.st_mtime_ns)
+    cached_key, cached_bundle = service_library_bundles.get(bundle_path, (None, None))
+    if cached_key == bundle_key:
+        return cached_bundle
+    if cached_bundle is not None:
+        cached_bundle.close()
+        del service_library_bundles[bundle_path]
+
+    try:
+        bundle = LibraryBundleClass(bundle_path)
+    except (OSError, ValueError):
+        return None
+
+    service_library_bundles[bundle_path] = (bundle_key, bundle)
+    return bundle
+
+
+def service_mode(socket_path=''):
+    import signal
+    import socket
+
+    # The socket helpers are shared with the client
+    from enkelt_klient import get_service_socket_path, is_private_directory, get_socket_peer_uid
+
+    # The socket is in a directory that only the user can use, so no one else can create it before the service does
+    socket_path = socket_path or get_service_socket_path()
+
+    # The client's stdin, stdout & stderr are sent with socket.send_fds() & socket.recv_fds()
+    if not hasattr(socket, 'recv_fds'):
+        print('Enkelt-tjänsten kräver Python 3.9 eller högre')
+        return
+
+    socket_directory = os.path.dirname(os.path.abspath(socket_path))
+    os.makedirs(socket_directory, mode=0o700, exist_ok=True)
+    if not is_private_directory(socket_directory):
+        print('Katalogen ' + socket_directory + ' måste ägas av dig och bara kunna användas av dig (chmod 700)')
+        return
+
+    # Another service already listens on the socket
+    if os.path.exists(socket_path):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as test_client:
+            try:
+                test_client.connect(socket_path)
+                print('En Enkelt-tjänst körs redan på ' + socket_path)
+                return
+            except OSError:
+                os.unlink(socket_path)
+
+    # Imports that are otherwise done by the first script that needs them
+    import symtable
+    import asyncio
+    import multiprocessing
+    import concurrent.futures
+    try:
+        import googletrans
+    except ImportError:
+        pass
+
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(socket_path)
+    os.chmod(socket_path, 0o600)
+    server.listen()
+
+    # The workers are never waited for, they send their exit status to the client themselves
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    # Stopping the service (ex. with kill) removes the socket, like Ctrl+C does
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    print('Enkelt-tjänsten lyssnar på ' + socket_path + ' (Ctrl+C för att avsluta)')
+    sys.stdout.flush()
+
+    try:
+        while True:
+            connection, _ = server.accept()
+            try:
+                # Only the user that started the service may run scripts with it
+                if get_socket_peer_uid(connection) not in (None, os.getuid()):
+                    continue
+
+                request, client_fds, _, _ = socket.recv_fds(connection, 65536, 3)
+                try:
+                    request = json.loads(request.decode('utf-8'))
+                    get_service_library_bundle(request['katalog'])
+                except (ValueError, KeyError, TypeError):
+                    request = None
+
+                if len(client_fds) == 3 and request is not None and os.fork() == 0:
+                    server.close()
+                    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+                    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                    run_service_request(connection, request, client_fds)
+                for client_fd in client_fds:
+                    os.close(client_fd)
+            finally:
+                connection.close()
+    except KeyboardInterrupt:
+        print()
+    finally:
+        server.close()
+        os.unlink(socket_path)
+
+
+# Runs in a forked worker, the script's stdin, stdout & stderr are the client's
+def run_service_request(connection, request, client_fds):
+    global enkelt_script_path
+    global library_bundle
+
+    status = 1
+    try:
+        for std_fd, client_fd in enumerate(client_fds):
+            os.dup2(client_fd, std_fd)
+            os.close(client_fd)
+
+        os.chdir(request['katalog'])
+        # Opened by the service before the fork
+        library_bundle = get_service_library_bundle(os.getcwd())
+        enkelt_script_path = request['sökväg']
+        sys.argv = [__file__, enkelt_script_path] + request['argument']
+        apply_flags(request['argument'])
+
+        with open(enkelt_script_path, encoding='utf-8') as script_file:
+            code_lines = script_file.readlines()
+
+        reset_transpiler_state()
+        status = 0 if prepare_and_run_code_lines_to_be_run(code_lines) else 1
+
+        if statistics is not None:
+            save_statistics()
+    except FileNotFoundError:
+        print('Filen ' + request['sökväg'] + ' kunde inte hittas!')
+    except BaseException as err:
+        print(err)
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        connection.sendall(str(status).encode('utf-8'))
+        os._exit(status)
+
+
+def apply_flags(flags):
+    global is_developer_mode
+    global is_profiling_mode
+    global profile_output_path
+    global statistics
+    global statistics_output_path
+    global is_watch_mode
+    global is_memory_profiling_mode
+    global memory_profile_output_path
+    global is_fast_locals_mode
+    global for_each_inputs
+    global for_each_workers
+    global for_each_results_path
+
+    # Checks if enkelt is being run in developer mode (--d flag), profiling mode (--profilera flag),
+    # memory profiling mode (--minne flag), statistics mode (--statistik flag), watch mode (--bevaka flag)
+    # or for each mode (--för-varje flag, followed by the inputs)
+    is_input = False
+    for flag in flags:
+        if is_input and not flag.startswith('--'):
+            for_each_inputs.append(flag)
+            continue
+        is_input = False
+
+        if flag == '--för-varje':
+            for_each_inputs = []
+            is_input = True
+        elif flag.startswith('--arbetare='):
+            workers = flag[len('--arbetare='):]
+            if not re.fullmatch(r'[0-9]+', workers) or int(workers) < 1:
+                raise ValueError('--arbetare måste vara ett heltal större än 0, inte "' + workers + '"')
+            for_each_workers = int(workers)
+        elif flag.startswith('--resultat='):
+            for_each_results_path = flag[len('--resultat='):]
+        elif flag == '--d':
+            is_developer_mode = True
+        elif flag == '--profilera' or flag.startswith('--profilera='):
+            is_profiling_mode = True
+            profile_output_path = flag[len('--profilera='):]
+        elif flag == '--minne' or flag.startswith('--minne='):
+            is_memory_profiling_mode = True
+            memory_profile_output_path = flag[len('--minne='):]
+            # The program's variables are kept in its namespace, so they're still there when the program ends
+            is_fast_locals_mode = False
+        elif flag == '--statistik' or flag.startswith('--statistik='):
+            statistics = StatisticsClass()
+            statistics_output_path = flag[len('--statistik='):]
+        elif flag == '--bevaka':
+            is_watch_mode = True
+
+
+def save_statistics():
+    global statistics
+    global statistics_output_path
+
+    if statistics_output_path:
+        with open(statistics_output_path, 'w', encoding='utf-8') as statistics_file:
+            json.dump(statistics.get_data(), statistics_file, indent=4)
+        print('Statistiken sparades i ' + statistics_output_path)
+    else:
+        print(statistics.get_report())
+
+
+def reset_transpiler_state():
+    global is_list
+    global is_if
+    global is_math
+    global is_for
+    global look_for_loop_ending
+    global needs_start_statuses
+    global is_file_open
+    global is_extension
+    global lambda_num
+    global source_code
+    global indent_layers
+    global imported_libraries
+    global user_functions
+    global final
+    global final_line_numbers
+
+    is_list = False
+    is_if = False
+    is_math = False
+    is_for = False
+    look_for_loop_ending = False
+    needs_start_statuses = [False]
+    is_file_open = False
+    is_extension = False
+    lambda_num = 0
+
+    source_code = []
+    indent_layers = []
+    imported_libraries = []
+    user_functions = []
+
+    final = []
+    final_line_numbers = []
+
+
 # ----- SETUP GLOBAL VARIABLES -----
 
 is_list = False
@@ -955,44 +2868,92 @@ is_console_mode = False
 source_code = []
 indent_layers = []
 imported_libraries = []
-standard_library = ['matte', 'tid']
+imported_files = set()
+standard_library = ['matte', 'tid', 'minne', 'parallell', 'asynk', 'fil', 'data', 'samlingar', 'mönster']
+default_memoize_size = 1024
 user_functions = []
 
 # When user/dev tests
 is_developer_mode = False
+# When the runtime of the script should be profiled (--profilera flag)
+is_profiling_mode = False
+profile_output_path = ''
+# When the memory the script allocates should be profiled per line (--minne flag)
+is_memory_profiling_mode = False
+memory_profile_output_path = ''
+# Collects time and size statistics of every phase when set (--statistik flag)
+statistics = None
+statistics_output_path = ''
+# The program runs inside a function, so that its variables are fast locals
+is_fast_locals_mode = True
+# Transpiled lines are reused between runs in watch mode (--bevaka flag)
+is_watch_mode = False
+transpiled_line_cache = None
+transpiled_line_cache_size = 1000
+# The script is run once for every input (--för-varje flag), in --arbetare processes
+for_each_inputs = None
+for_each_workers = 0
+for_each_results_path = ''
+for_each_compiled = None
 # Gets an env. variable to check if it's a circle-ci test run.
 is_dev = os.getenv('ENKELT_DEV', False)
 
 version = 4.1
 repo_location = 'https://raw.githubusercontent.com/Enkelt/Enkelt/'
 web_import_location = 'https://raw.githubusercontent.com/Enkelt/EnkeltWeb/master/bibliotek/bib/'
+# The libraries installed with lib.py, opened when a library is imported
+library_bundle_path = os.path.join('bib', 'bibliotek.ebib')
+library_bundle = None
+transpiler_fingerprint = None
+# Remote libraries aren't fetched (the language server's dry-run compile), they're left out of the code
+is_offline = False
+skipped_remote_libraries = []
+# The Enkelt code of the libraries in a bundle that's being written, see get_bundle_entry()
+library_sources = {}
 
 final = []
+final_line_numbers = []
 variables = []
 
 enkelt_script_path = ''
 
 # ----- START -----
-if not is_dev:
+if not is_dev and __name__ == '__main__':
     try:
         if sys.version_info[0] < 3:
             raise Exception("Du måste använda Python 3 eller högre")
 
+        # Starts the resident service (--tjänst flag), scripts are then run with enkelt_klient.py
+        if len(sys.argv) >= 2 and (sys.argv[1] == '--tjänst' or sys.argv[1].startswith('--tjänst=')):
+            service_mode(sys.argv[1][len('--tjänst='):])
         # Checks if code is being provided from an enkelt script or if it's a console/repl mode launch
-        if len(sys.argv) >= 2:
+        elif len(sys.argv) >= 2:
             if '.e' in sys.argv[1]:
                 enkelt_script_path = sys.argv[1]
 
-            # Checks if enkelt is being run in developer mode (--d flag)
-            if len(sys.argv) >= 3:
-                if sys.argv[2] == '--d':
-                    is_developer_mode = True
+            try:
+                apply_flags(sys.argv[2:])
+            except ValueError as err:
+                print(err)
+                sys.exit(1)
+
+            if is_watch_mode and os.path.isfile(enkelt_script_path):
+                watch_mode()
+            elif for_each_inputs is not None and os.path.isfile(enkelt_script_path):
+                with open(enkelt_script_path, encoding='utf-8') as f:
+                    tmp_code_to_run = f.readlines()
 
-            if os.path.isfile(os.getcwd() + '/' + enkelt_script_path):
+                # The exit status is 1 when the script fails for any of the inputs
+                if not for_each_mode(tmp_code_to_run):
+                    sys.exit(1)
+            elif os.path.isfile(os.getcwd() + '/' + enkelt_script_path):
                 with open(enkelt_script_path, encoding='utf-8') as f:
                     tmp_code_to_run = f.readlines()
 
                 prepare_and_run_code_lines_to_be_run(tmp_code_to_run)
+
+                if statistics is not None:
+                    save_statistics()
             else:
                 print('Filen ' + enkelt_script_path + ' kunde inte hittas!')
 
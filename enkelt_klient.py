@@ -0,0 +1,83 @@
+import os
+import sys
+import json
+import stat
+import socket
+import struct
+import tempfile
+
+
+# Runs an Enkelt script with the service started by "python enkelt.py --tjänst".
+# Usage: python enkelt_klient.py [--tjänst=sökväg] fil.e [flaggor]
+# The socket helpers are used by the service too, this file doesn't import enkelt.py so that the client starts fast
+
+# The socket is in a directory that only the user can use, so no one else can create it before the service does
+def get_service_socket_path():
+    directory = os.environ.get('XDG_RUNTIME_DIR') or os.path.join(tempfile.gettempdir(), 'enkelt-' + str(os.getuid()))
+
+    return os.path.join(directory, 'enkelt.sock')
+
+
+def is_private_directory(directory):
+    status = os.lstat(directory)
+
+    return stat.S_ISDIR(status.st_mode) and status.st_uid == os.getuid() and not status.st_mode & 0o077
+
+
+# The uid of the process on the other end of the socket, None where SO_PEERCRED is missing (ex. macOS)
+def get_socket_peer_uid(connection):
+    if not hasattr(socket, 'SO_PEERCRED'):
+        return None
+
+    credentials = connection.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i'))
+    return struct.unpack('3i', credentials)[1]
+
+
+def main(args):
+    socket_path = get_service_socket_path()
+    if args and args[0].startswith('--tjänst='):
+        socket_path = args[0][len('--tjänst='):]
+        args = args[1:]
+
+    if not args:
+        print('Användning: python enkelt_klient.py [--tjänst=sökväg] fil.e [flaggor]')
+        return 2
+
+    if not hasattr(socket, 'send_fds'):
+        print('Enkelt-tjänsten kräver Python 3.9 eller högre')
+        return 1
+
+    request = {
+        'sökväg': os.path.abspath(args[0]),
+        'argument': args[1:],
+        'katalog': os.getcwd(),
+    }
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        try:
+            client.connect(socket_path)
+        except OSError:
+            print('Enkelt-tjänsten körs inte, starta den med: python enkelt.py --tjänst')
+            return 1
+
+        # The script would get this process' stdin, stdout & stderr, so the service has to be the user's own
+        if not is_private_directory(os.path.dirname(os.path.abspath(socket_path))) or \
+                get_socket_peer_uid(client) not in (None, os.getuid()):
+            print('Enkelt-tjänsten på ' + socket_path + ' körs inte av dig')
+            return 1
+
+        # The script reads from and writes to this process' stdin, stdout & stderr directly
+        socket.send_fds(client, [json.dumps(request).encode('utf-8')], [0, 1, 2])
+
+        status = b''
+        while True:
+            data = client.recv(16)
+            if not data:
+                break
+            status += data
+
+    return int(status) if status else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
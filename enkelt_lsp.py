@@ -0,0 +1,481 @@
+import os
+import re
+import sys
+import json
+import time
+import select
+import signal
+import collections
+
+import enkelt
+
+
+# A language server (LSP) for Enkelt, run by editors as "python enkelt_lsp.py" over stdin/stdout.
+# It serves semantic tokens, diagnostics and go-to-definition for user functions.
+# Every line keeps its own tokens, so an edit only lexes the lines it changed. A line is lexed when its tokens are
+# first needed, only the lines that can define a function are lexed when the document is opened.
+# Positions are counted in characters, which is the same as UTF-16 for everything but ex. emojis.
+
+semantic_token_types = ['keyword', 'function', 'variable', 'string', 'number', 'operator', 'comment', 'namespace']
+semantic_token_modifiers = ['declaration', 'defaultLibrary']
+
+token_kind_semantic_types = {
+    enkelt.TokenKind.KEYWORD: (0, 0),
+    enkelt.TokenKind.BOOL: (0, 0),
+    enkelt.TokenKind.OBJ_NOTATION: (0, 0),
+    enkelt.TokenKind.MEMOIZE: (0, 0),
+    enkelt.TokenKind.ASYNC: (0, 0),
+    enkelt.TokenKind.COMPREHENSION_FOR: (0, 0),
+    enkelt.TokenKind.FUNCTION: (1, 2),
+    enkelt.TokenKind.USER_FUNCTION: (1, 1),
+    enkelt.TokenKind.USER_FUNCTION_CALL: (1, 0),
+    enkelt.TokenKind.VAR: (2, 0),
+    enkelt.TokenKind.STRING: (3, 0),
+    enkelt.TokenKind.PNUMBER: (4, 0),
+    enkelt.TokenKind.NNUMBER: (4, 0),
+    enkelt.TokenKind.OPERATOR: (5, 0),
+    enkelt.TokenKind.COMMENT: (6, 0),
+    enkelt.TokenKind.IMPORT: (7, 0),
+    enkelt.TokenKind.EXTENSION: (7, 0),
+}
+
+# Seconds without new messages before the diagnostics are updated
+diagnostics_delay = 0.3
+# Seconds a dry-run compile may take
+diagnostics_timeout = 10
+
+word_pattern = re.compile(r'[\w.]+')
+
+
+# Where a token is written in its line, the lexer removes the spaces so the token is searched for
+def get_token_source_text(line, token):
+    if token.kind == enkelt.TokenKind.VAR:
+        return '$' + token.value.rstrip()
+    if token.kind == enkelt.TokenKind.STRING:
+        value = token.value.replace('|-ENKELT_ESCAPED_QUOTE-|', '\\"').replace('|-ENKELT_ESCAPED_BACKSLASH-|', '\\')
+        return '"' + value + '"'
+    if token.kind == enkelt.TokenKind.COMMENT:
+        return line[line.find('#'):]
+    if token.kind == enkelt.TokenKind.MEMOIZE:
+        return 'minne'
+    return token.value
+
+
+# The lexer removes the spaces, so "d ef" could be a "def" too. Every line that defines a function passes, and a few
+# that don't (ex. "def" in a string)
+def can_define_function(line):
+    return 'def' in line.replace(' ', '').replace('\t', '')
+
+
+# The line's part of the semantic tokens data, the first token's line delta is filled in by the document
+def get_semantic_tokens_of_line(line, tokens):
+    data = []
+    cursor = 0
+    previous_start = 0
+
+    for token in tokens:
+        semantic_type = token_kind_semantic_types.get(token.kind)
+        if semantic_type is None:
+            continue
+
+        text = get_token_source_text(line, token)
+        start = line.find(text, cursor) if text else -1
+        if start == -1:
+            continue
+
+        data += [0, start - previous_start, len(text), semantic_type[0], semantic_type[1]]
+        cursor = start + len(text)
+        previous_start = start
+
+    return data
+
+
+class EnkeltDocument:
+    def __init__(self, text):
+        self.lines = text.split('\n')
+        # None for a line that hasn't been lexed yet
+        self.tokens = [None for _ in self.lines]
+        self.line_functions = [() for _ in self.lines]
+        self.semantic_tokens = [None for _ in self.lines]
+        # User function name -> the line it's defined on, built when it's needed
+        self.definitions = None
+
+        # Every line is lexed knowing all the user functions of the document, also the ones defined after it,
+        # so the lines that define them are lexed first
+        self.function_counts = collections.Counter()
+        self.lex_lines([line_index for line_index, line in enumerate(self.lines) if can_define_function(line)])
+
+    def lex_lines(self, line_indexes):
+        functions_before = set(self.function_counts)
+        enkelt.user_functions = list(functions_before)
+
+        for line_index in line_indexes:
+            self.function_counts.subtract(self.line_functions[line_index])
+
+            fixed_line = enkelt.fix_up_code_line(self.lines[line_index])
+            try:
+                self.tokens[line_index] = enkelt.lex(fixed_line) if fixed_line else []
+            except Exception:
+                self.tokens[line_index] = []
+
+            # The functions the line defines are added by the lexer, they're removed for the next line
+            line_functions = tuple(enkelt.user_functions[len(functions_before):])
+            del enkelt.user_functions[len(functions_before):]
+            if line_functions != self.line_functions[line_index]:
+                self.definitions = None
+
+            self.line_functions[line_index] = line_functions
+            self.function_counts.update(line_functions)
+            self.semantic_tokens[line_index] = None
+
+        self.function_counts += collections.Counter()
+
+        # The other lines that use a function that was added or removed are lexed again when they're needed. The
+        # functions a line defines don't depend on the other functions, so they're still right
+        changed_functions = functions_before ^ set(self.function_counts)
+        if changed_functions:
+            line_indexes = set(line_indexes)
+            for line_index, line in enumerate(self.lines):
+                if self.tokens[line_index] is not None and line_index not in line_indexes and \
+                        any(name in line for name in changed_functions):
+                    self.tokens[line_index] = None
+                    self.semantic_tokens[line_index] = None
+
+    # Applies an incremental (or a full) change from the editor
+    def apply_change(self, change):
+        if 'range' not in change:
+            self.__init__(change['text'])
+            return
+
+        start = change['range']['start']
+        end = change['range']['end']
+        new_lines = (
+            self.lines[start['line']][:start['character']] + change['text'] + self.lines[end['line']][end['character']:]
+        ).split('\n')
+
+        # The lines of the change are replaced, the other lines keep their tokens
+        for line_index in range(start['line'], end['line'] + 1):
+            self.function_counts.subtract(self.line_functions[line_index])
+            if self.line_functions[line_index]:
+                self.definitions = None
+
+        # The definitions after the change are moved, unless a definition was changed
+        line_count_change = len(new_lines) - (end['line'] + 1 - start['line'])
+        if self.definitions and line_count_change:
+            for name, definition_line in self.definitions.items():
+                if definition_line > end['line']:
+                    self.definitions[name] = definition_line + line_count_change
+
+        line_slice = slice(start['line'], end['line'] + 1)
+        self.lines[line_slice] = new_lines
+        self.tokens[line_slice] = [None for _ in new_lines]
+        self.line_functions[line_slice] = [() for _ in new_lines]
+        self.semantic_tokens[line_slice] = [None for _ in new_lines]
+
+        self.lex_lines(range(start['line'], start['line'] + len(new_lines)))
+
+    def get_semantic_tokens(self, first_line=0, last_line=None):
+        last_line = len(self.lines) - 1 if last_line is None else min(last_line, len(self.lines) - 1)
+
+        unlexed_lines = [
+            line_index for line_index in range(first_line, last_line + 1) if self.tokens[line_index] is None
+        ]
+        if unlexed_lines:
+            self.lex_lines(unlexed_lines)
+
+        data = []
+        previous_line = 0
+        for line_index in range(first_line, last_line + 1):
+            line_data = self.semantic_tokens[line_index]
+            if line_data is None:
+                line_data = self.semantic_tokens[line_index] = get_semantic_tokens_of_line(
+                    self.lines[line_index], self.tokens[line_index]
+                )
+
+            if line_data:
+                data.append(line_index - previous_line)
+                data.extend(line_data[1:])
+                previous_line = line_index
+
+        return data
+
+    def get_definition_line(self, line_index, character):
+        if self.definitions is None:
+            # From the end, so the first definition of a name is the one kept
+            self.definitions = {
+                name: definition_line
+                for definition_line in range(len(self.line_functions) - 1, -1, -1)
+                for name in self.line_functions[definition_line]
+            }
+
+        line = self.lines[line_index] if line_index < len(self.lines) else ''
+        for word in word_pattern.finditer(line):
+            if word.start() <= character <= word.end():
+                name = word.group()
+                # Ex. "bibliotek.funktion" when the cursor is on a call to an imported function
+                for candidate in [name, name.split('.')[-1]]:
+                    if candidate in self.definitions:
+                        return self.definitions[candidate]
+        return None
+
+    # Transpiles & compiles the whole document without running it.
+    # The transpiler's state is changed, so it's run in a forked process by the server.
+    def get_diagnostics(self):
+        enkelt.reset_transpiler_state()
+
+        line_number = 0
+        try:
+            for line_number, line in enumerate(self.lines, 1):
+                enkelt.transpile_line(line + '\n', line_number)
+            line_number = 0
+
+            enkelt.compile_transpiled_code(enkelt.fix_up_and_prepare_transpiled_code())
+        except Exception as err:
+            line_number = line_number or getattr(err, 'lineno', None) or enkelt.get_enkelt_line_number(err) or 1
+            line_index = min(max(line_number - 1, 0), len(self.lines) - 1)
+
+            error_type = enkelt.get_errors().get(type(err).__name__, '')
+            return [{
+                'range': {
+                    'start': {'line': line_index, 'character': 0},
+                    'end': {'line': line_index, 'character': len(self.lines[line_index])},
+                },
+                'severity': 1,
+                'source': 'enkelt',
+                'message': (error_type + ': ' if error_type else '') + str(err),
+            }]
+
+        return []
+
+
+class LanguageServer:
+    def __init__(self, input_fd=0, output=None):
+        self.input_fd = input_fd
+        self.output = output or sys.stdout.buffer
+        self.input_buffer = b''
+
+        self.documents = {}
+        self.is_running = True
+        self.is_shut_down = False
+
+        # uri -> the time the document was changed, for documents that need new diagnostics
+        self.pending_diagnostics = {}
+        # uri -> (pid, read fd, start time) of a running dry-run compile
+        self.diagnostics_processes = {}
+
+    # ######## #
+    # Protocol #
+    # ######## #
+
+    def read_message(self):
+        while True:
+            header_end = self.input_buffer.find(b'\r\n\r\n')
+            if header_end != -1:
+                headers = self.input_buffer[:header_end].decode('ascii').split('\r\n')
+                content_length = 0
+                for header in headers:
+                    name, _, value = header.partition(':')
+                    if name.strip().lower() == 'content-length':
+                        content_length = int(value)
+
+                body_start = header_end + 4
+                if len(self.input_buffer) >= body_start + content_length:
+                    body = self.input_buffer[body_start:body_start + content_length]
+                    self.input_buffer = self.input_buffer[body_start + content_length:]
+                    return json.loads(body.decode('utf-8'))
+
+            data = os.read(self.input_fd, 65536)
+            if not data:
+                return None
+            self.input_buffer += data
+
+    def has_buffered_message(self):
+        return b'\r\n\r\n' in self.input_buffer
+
+    def send(self, message):
+        body = json.dumps(message, ensure_ascii=False).encode('utf-8')
+        self.output.write(b'Content-Length: ' + str(len(body)).encode('ascii') + b'\r\n\r\n' + body)
+        self.output.flush()
+
+    def run(self):
+        while self.is_running:
+            wait_fds = [self.input_fd] + [process[1] for process in self.diagnostics_processes.values()]
+            timeout = None if not self.pending_diagnostics and not self.diagnostics_processes else diagnostics_delay
+
+            readable = [self.input_fd] if self.has_buffered_message() else select.select(wait_fds, [], [], timeout)[0]
+
+            if self.input_fd in readable:
+                message = self.read_message()
+                if message is None:
+                    break
+                self.handle_message(message)
+
+            self.update_diagnostics(readable)
+
+        for pid, _, _ in self.diagnostics_processes.values():
+            os.kill(pid, signal.SIGKILL)
+
+    def handle_message(self, message):
+        handler = getattr(self, 'on_' + message.get('method', '').replace('/', '_').replace('$', 'dollar'), None)
+
+        if 'id' not in message:
+            if handler is not None:
+                handler(message.get('params', {}))
+            return
+
+        if handler is None:
+            self.send({'jsonrpc': '2.0', 'id': message['id'], 'error': {'code': -32601, 'message': 'Okänd metod'}})
+            return
+
+        try:
+            result = handler(message.get('params', {}))
+            self.send({'jsonrpc': '2.0', 'id': message['id'], 'result': result})
+        except Exception as err:
+            self.send({'jsonrpc': '2.0', 'id': message['id'], 'error': {'code': -32603, 'message': str(err)}})
+
+    # ########### #
+    # Diagnostics #
+    # ########### #
+
+    def update_diagnostics(self, readable):
+        now = time.monotonic()
+
+        for uri, (pid, read_fd, start_time) in list(self.diagnostics_processes.items()):
+            if read_fd in readable or now - start_time > diagnostics_timeout:
+                if read_fd in readable:
+                    result = b''
+                    while True:
+                        data = os.read(read_fd, 65536)
+                        if not data:
+                            break
+                        result += data
+                else:
+                    os.kill(pid, signal.SIGKILL)
+                    result = b''
+
+                os.close(read_fd)
+                os.waitpid(pid, 0)
+                del self.diagnostics_processes[uri]
+
+                # A newer change is already waiting for its own diagnostics
+                if result and uri in self.documents and uri not in self.pending_diagnostics:
+                    self.send({
+                        'jsonrpc': '2.0',
+                        'method': 'textDocument/publishDiagnostics',
+                        'params': {'uri': uri, 'diagnostics': json.loads(result.decode('utf-8'))},
+                    })
+
+        for uri, change_time in list(self.pending_diagnostics.items()):
+            if now - change_time >= diagnostics_delay and uri not in self.diagnostics_processes:
+                del self.pending_diagnostics[uri]
+                if uri in self.documents:
+                    self.start_diagnostics_process(uri)
+
+    def start_diagnostics_process(self, uri):
+        read_fd, write_fd = os.pipe()
+
+        self.output.flush()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            try:
+                # The dry-run compile writes nothing to the editor, only the diagnostics are sent back
+                sys.stdout = open(os.devnull, 'w')
+                # and doesn't wait on the network for the libraries that the document imports
+                enkelt.is_offline = True
+                diagnostics = self.documents[uri].get_diagnostics()
+            except BaseException as err:
+                diagnostics = [{
+                    'range': {'start': {'line': 0, 'character': 0}, 'end': {'line': 0, 'character': 0}},
+                    'severity': 1,
+                    'source': 'enkelt',
+                    'message': str(err),
+                }]
+            os.write(write_fd, json.dumps(diagnostics, ensure_ascii=False).encode('utf-8'))
+            os._exit(0)
+
+        os.close(write_fd)
+        self.diagnostics_processes[uri] = (pid, read_fd, time.monotonic())
+
+    # ######## #
+    # Handlers #
+    # ######## #
+
+    def on_initialize(self, params):
+        return {
+            'capabilities': {
+                'textDocumentSync': {'openClose': True, 'change': 2, 'save': True},
+                'semanticTokensProvider': {
+                    'legend': {'tokenTypes': semantic_token_types, 'tokenModifiers': semantic_token_modifiers},
+                    'full': True,
+                    'range': True,
+                },
+                'definitionProvider': True,
+            },
+            'serverInfo': {'name': 'enkelt-lsp', 'version': str(enkelt.version)},
+        }
+
+    def on_initialized(self, params):
+        pass
+
+    def on_shutdown(self, params):
+        self.is_shut_down = True
+        return None
+
+    def on_exit(self, params):
+        self.is_running = False
+
+    def on_textDocument_didOpen(self, params):
+        uri = params['textDocument']['uri']
+        self.documents[uri] = EnkeltDocument(params['textDocument']['text'])
+        self.pending_diagnostics[uri] = 0
+
+    def on_textDocument_didChange(self, params):
+        uri = params['textDocument']['uri']
+        for change in params['contentChanges']:
+            self.documents[uri].apply_change(change)
+        self.pending_diagnostics[uri] = time.monotonic()
+
+    def on_textDocument_didSave(self, params):
+        self.pending_diagnostics[params['textDocument']['uri']] = 0
+
+    def on_textDocument_didClose(self, params):
+        uri = params['textDocument']['uri']
+        self.documents.pop(uri, None)
+        self.pending_diagnostics.pop(uri, None)
+        self.send({
+            'jsonrpc': '2.0',
+            'method': 'textDocument/publishDiagnostics',
+            'params': {'uri': uri, 'diagnostics': []},
+        })
+
+    def on_textDocument_semanticTokens_full(self, params):
+        return {'data': self.documents[params['textDocument']['uri']].get_semantic_tokens()}
+
+    def on_textDocument_semanticTokens_range(self, params):
+        document = self.documents[params['textDocument']['uri']]
+        token_range = params['range']
+
+        # The first line delta is counted from the start of the document, like in a full response
+        return {'data': document.get_semantic_tokens(token_range['start']['line'], token_range['end']['line'])}
+
+    def on_textDocument_definition(self, params):
+        uri = params['textDocument']['uri']
+        position = params['position']
+
+        definition_line = self.documents[uri].get_definition_line(position['line'], position['character'])
+        if definition_line is None:
+            return None
+
+        line = self.documents[uri].lines[definition_line]
+        return {
+            'uri': uri,
+            'range': {
+                'start': {'line': definition_line, 'character': 0},
+                'end': {'line': definition_line, 'character': len(line)},
+            },
+        }
+
+
+if __name__ == '__main__':
+    LanguageServer().run()
@@ -0,0 +1,371 @@
+import os
+import sys
+import time
+import atexit
+import select
+import signal
+import resource
+import threading
+import multiprocessing
+import concurrent.futures
+
+import enkelt
+
+
+# Runs untrusted Enkelt programs in a pool of pre-forked workers (Linux/Unix only).
+# Every job runs in its own fork of a worker, with hard CPU, memory, open file and process limits,
+# so a program can never change the limits or the worker for the jobs that come after it.
+# When a job ends, every process it started is killed as well.
+#
+#   with SandboxPool(workers=8, cpu_seconds=2) as pool:
+#       result = pool.submit('skriv("hej")\n').result()
+#       print(result.status, result.output)
+#
+# The workers aren't daemon processes, since a job of a daemon can't start processes of its own (ex. parallell.karta).
+# A pool that isn't closed (with close() or a with statement) is closed when Python exits.
+
+# Exit codes of the job processes
+JOB_OK = 0
+JOB_ERROR = 1
+JOB_MEMORY_LIMIT = 2
+
+PR_SET_CHILD_SUBREAPER = 36
+
+
+class SandboxResult:
+    def __init__(self, status, output, duration):
+        # One of 'ok', 'error', 'memory_limit', 'cpu_limit', 'timeout', 'output_limit' or 'killed'
+        self.status = status
+        self.output = output
+        self.duration = duration
+
+    def __repr__(self):
+        return 'SandboxResult(status={!r}, output={!r}, duration={:.3f})'.format(
+            self.status, self.output, self.duration
+        )
+
+
+class SandboxLimits:
+    def __init__(self, cpu_seconds, memory_bytes, open_files, timeout, max_output, process_limit):
+        self.cpu_seconds = cpu_seconds
+        self.memory_bytes = memory_bytes
+        self.open_files = open_files
+        self.timeout = timeout
+        self.max_output = max_output
+        # RLIMIT_NPROC of the jobs, None when the processes of the user can't be counted
+        self.process_limit = process_limit
+
+
+# ############################### #
+# Job process (fork of a worker)  #
+# ############################### #
+
+def close_inherited_fds():
+    # Only the open fds are closed when they can be listed, closing every possible fd takes milliseconds
+    if os.path.isdir('/proc/self/fd'):
+        for fd in [int(fd) for fd in os.listdir('/proc/self/fd')]:
+            if fd > 2:
+                try:
+                    os.close(fd)
+                except OSError:
+                    pass
+    else:
+        os.closerange(3, resource.getrlimit(resource.RLIMIT_NOFILE)[0])
+
+
+def run_job(source, limits, output_fd):
+    exit_code = JOB_ERROR
+
+    try:
+        # The program's output (and errors) go to the worker through the pipe, and it can't reach any other fd
+        os.dup2(output_fd, 1)
+        os.dup2(output_fd, 2)
+        close_inherited_fds()
+        sys.stdout = open(1, 'w', encoding='utf-8', closefd=False)
+        sys.stderr = open(2, 'w', encoding='utf-8', closefd=False)
+
+        # Hard limits can't be raised again by the program
+        resource.setrlimit(resource.RLIMIT_CPU, (limits.cpu_seconds, limits.cpu_seconds))
+        resource.setrlimit(resource.RLIMIT_AS, (limits.memory_bytes, limits.memory_bytes))
+        resource.setrlimit(resource.RLIMIT_NOFILE, (limits.open_files, limits.open_files))
+        # The CPU limit is per process, so the processes a job can start are limited as well
+        if limits.process_limit is not None:
+            resource.setrlimit(resource.RLIMIT_NPROC, (limits.process_limit, limits.process_limit))
+
+        enkelt.reset_transpiler_state()
+        for line_number, line in enumerate(source.splitlines(keepends=True), 1):
+            enkelt.transpile_line(line, line_number)
+
+        # Like run_transpiled_code(), but a program that runs out of memory is told apart from other errors
+        try:
+            compiled = enkelt.compile_transpiled_code(enkelt.fix_up_and_prepare_transpiled_code())
+            enkelt.execute_compiled_code(compiled, enkelt.get_program_namespace())
+            exit_code = JOB_OK
+        except MemoryError:
+            exit_code = JOB_MEMORY_LIMIT
+        except Exception as err:
+            enkelt.print_program_error(err)
+    except MemoryError:
+        exit_code = JOB_MEMORY_LIMIT
+    except BaseException as err:
+        print(err)
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        finally:
+            os._exit(exit_code)
+
+
+# ###################### #
+# Worker process (reused) #
+# ###################### #
+
+def run_job_in_fork(source, limits):
+    read_fd, write_fd = os.pipe()
+    start_time = time.monotonic()
+
+    sys.stdout.flush()
+    sys.stderr.flush()
+    pid = os.fork()
+    if pid == 0:
+        # The job and every process it starts are in their own process group, so they're killed together
+        os.setpgid(0, 0)
+        os.close(read_fd)
+        run_job(source, limits, write_fd)
+    # Also set here, so that the group exists even if the job is killed before it has run
+    try:
+        os.setpgid(pid, pid)
+    except OSError:
+        pass
+    os.close(write_fd)
+
+    output = bytearray()
+    status = None
+    deadline = start_time + limits.timeout
+    try:
+        while True:
+            remaining_time = deadline - time.monotonic()
+            if remaining_time <= 0:
+                status = 'timeout'
+                break
+
+            readable, _, _ = select.select([read_fd], [], [], remaining_time)
+            if readable:
+                data = os.read(read_fd, 65536)
+                if not data:
+                    break
+
+                output += data
+                if len(output) > limits.max_output:
+                    del output[limits.max_output:]
+                    status = 'output_limit'
+                    break
+    finally:
+        os.close(read_fd)
+
+    # The job can close its output and keep running, so it's only waited for until the deadline
+    wait_status = None
+    poll_interval = 0.0005
+    while status is None:
+        waited_pid, wait_status = os.waitpid(pid, os.WNOHANG)
+        if waited_pid:
+            break
+
+        remaining_time = deadline - time.monotonic()
+        if remaining_time <= 0:
+            status = 'timeout'
+        else:
+            time.sleep(min(poll_interval, remaining_time))
+            poll_interval = min(poll_interval * 2, 0.05)
+
+    if status is not None:
+        kill_process_group(pid)
+        _, wait_status = os.waitpid(pid, 0)
+    # Processes the job started and left running
+    kill_process_group(pid)
+    kill_child_processes()
+
+    if status is None:
+        exit_code = os.waitstatus_to_exitcode(wait_status)
+        if exit_code == JOB_OK:
+            status = 'ok'
+        elif exit_code == JOB_MEMORY_LIMIT:
+            status = 'memory_limit'
+        elif exit_code in [-signal.SIGXCPU, -signal.SIGKILL]:
+            status = 'cpu_limit'
+        elif exit_code < 0:
+            status = 'killed'
+        else:
+            status = 'error'
+
+    return SandboxResult(status, output.decode('utf-8', errors='replace'), time.monotonic() - start_time)
+
+
+def kill_process_group(pid):
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+def get_child_pids():
+    child_pids = set()
+    if os.path.isdir('/proc/self/task'):
+        for task in os.listdir('/proc/self/task'):
+            try:
+                with open('/proc/self/task/' + task + '/children') as children_file:
+                    child_pids.update(int(child_pid) for child_pid in children_file.read().split())
+            except OSError:
+                pass
+    return child_pids
+
+
+# A process that left the job's process group (ex. with setsid) is moved to the worker when its parent dies,
+# since the worker is a subreaper. The children are killed until there are none left.
+def kill_child_processes():
+    child_pids = get_child_pids()
+    while child_pids:
+        for child_pid in child_pids:
+            try:
+                os.kill(child_pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        for child_pid in child_pids:
+            try:
+                os.waitpid(child_pid, 0)
+            except ChildProcessError:
+                pass
+        child_pids = get_child_pids()
+
+
+def become_subreaper():
+    # prctl(PR_SET_CHILD_SUBREAPER) is Linux only, elsewhere only the job's process group is killed
+    try:
+        import ctypes
+        return ctypes.CDLL(None, use_errno=True).prctl(PR_SET_CHILD_SUBREAPER, 1, 0, 0, 0) == 0
+    except (OSError, AttributeError):
+        return False
+
+
+# The number of processes (and threads, that count as well) the user runs, None if it can't be counted
+def get_user_process_count():
+    if not os.path.isdir('/proc/self/task'):
+        return None
+
+    process_count = 0
+    for pid in os.listdir('/proc'):
+        if pid.isdigit():
+            try:
+                if os.stat('/proc/' + pid).st_uid == os.getuid():
+                    process_count += len(os.listdir('/proc/' + pid + '/task'))
+            except OSError:
+                pass
+    return process_count
+
+
+def sandbox_worker(job_queue, result_queue, limits):
+    # The jobs are waited for one by one
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    become_subreaper()
+
+    while True:
+        job = job_queue.get()
+        if job is None:
+            return
+
+        job_id, source = job
+        try:
+            result = run_job_in_fork(source, limits)
+        except Exception as err:
+            result = SandboxResult('error', str(err), 0)
+        result_queue.put((job_id, result))
+
+
+# #### #
+# Pool #
+# #### #
+
+class SandboxPool:
+    def __init__(self, workers=None, cpu_seconds=5, memory_bytes=256 * 1024 * 1024, open_files=64, timeout=10,
+                 max_output=64 * 1024, processes=16):
+        workers = workers or os.cpu_count() or 1
+
+        # RLIMIT_NPROC counts every process of the user, so it's the processes the user already runs, the workers
+        # and their jobs, and the processes every job may start. The pool is best run as a user of its own.
+        user_process_count = get_user_process_count()
+        process_limit = None
+        if user_process_count is not None:
+            process_limit = user_process_count + workers * (processes + 2)
+
+        self.limits = SandboxLimits(cpu_seconds, memory_bytes, open_files, timeout, max_output, process_limit)
+
+        context = multiprocessing.get_context('fork')
+        self.job_queue = context.SimpleQueue()
+        self.result_queue = context.SimpleQueue()
+
+        self.futures = {}
+        self.futures_lock = threading.Lock()
+        self.next_job_id = 0
+
+        self.workers = [
+            context.Process(target=sandbox_worker, args=(self.job_queue, self.result_queue, self.limits))
+            for _ in range(workers)
+        ]
+        for worker in self.workers:
+            worker.start()
+
+        # Hands the results to the futures of the jobs
+        self.collector = threading.Thread(target=self.collect_results, daemon=True)
+        self.collector.start()
+
+        self.is_closed = False
+        atexit.register(self.close)
+
+    def collect_results(self):
+        while True:
+            job_id, result = self.result_queue.get()
+            if job_id is None:
+                return
+
+            with self.futures_lock:
+                future = self.futures.pop(job_id)
+            future.set_result(result)
+
+    def submit(self, source):
+        future = concurrent.futures.Future()
+
+        with self.futures_lock:
+            job_id = self.next_job_id
+            self.next_job_id += 1
+            self.futures[job_id] = future
+        self.job_queue.put((job_id, source))
+
+        return future
+
+    def map(self, sources):
+        futures = [self.submit(source) for source in sources]
+
+        return [future.result() for future in futures]
+
+    def close(self):
+        if self.is_closed:
+            return
+        self.is_closed = True
+        atexit.unregister(self.close)
+
+        for _ in self.workers:
+            self.job_queue.put(None)
+        for worker in self.workers:
+            worker.join()
+
+        self.result_queue.put((None, None))
+        self.collector.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+        return False
@@ -18,9 +18,12 @@
 #     along with Enkelt.  If not, see <https://www.gnu.org/licenses/>.
 
 import urllib.request
+import urllib.error
 import sys
 import os
 
+import enkelt
+
 
 def show_help_message(sys_args):
 	if len(sys_args) > 1:
@@ -28,11 +31,41 @@ def show_help_message(sys_args):
 	print('Prova hjälpkommandot:\npython3 lib.py hjälp\n')
 
 
+def get_installed_modules():
+	# Module name -> the module's Enkelt code
+	if os.path.isfile(library_bundle_path):
+		bundle = enkelt.LibraryBundleClass(library_bundle_path)
+		try:
+			return {module_name: bundle.read(module_name, 'källa') for module_name in bundle.libraries}
+		finally:
+			bundle.close()
+
+	# Modules installed before the bundle are loose files, they're moved into the bundle on the next change
+	modules = {}
+	if os.path.isdir('bib'):
+		for file_name in os.listdir('bib'):
+			if file_name.endswith('.e'):
+				with open(os.path.join('bib', file_name), encoding='utf-8') as f:
+					modules[file_name[:-2]] = f.read()
+	return modules
+
+
+def save_installed_modules(modules):
+	# Every module is transpiled again, so the pre-transpiled code always comes from this transpiler. The modules
+	# that a module imports are transpiled from the modules being saved, nothing is fetched from the web
+	bundle_entries = {}
+	for module_name in sorted(modules):
+		bundle_entries[module_name] = enkelt.get_bundle_entry(module_name, modules[module_name], modules)
+
+	os.makedirs(os.path.dirname(library_bundle_path) or '.', exist_ok=True)
+	enkelt.LibraryBundleClass.write(library_bundle_path, bundle_entries)
+
+
 def install(enkelt_module):
-	local_path = 'bib/' + enkelt_module + '.e'
 	web_path = web_import_location + enkelt_module + '.e'
+	modules = get_installed_modules()
 
-	if os.path.isfile(local_path):
+	if enkelt_module in modules:
 		print('Modulen ', enkelt_module, ' är redan installerad.')
 		ans = input('Vill du uppdatera den? (J/n) ')
 		if ans.lower() == 'j' or ans == '':
@@ -40,42 +73,34 @@ def install(enkelt_module):
 	else:
 		try:
 			response = urllib.request.urlopen(web_path)
-			module_code = response.read().decode('utf-8')
-
-			with open(local_path, 'w') as f:
-				f.write(module_code)
-				f.close()
-
-			if os.path.isfile(local_path):
-				print('Modulen ', enkelt_module, ' installerad.')
-		except Exception:
+			modules[enkelt_module] = response.read().decode('utf-8')
+		except urllib.error.URLError:
 			print('Modulen ', enkelt_module, ' kunde inte hittas.')
+			return
+
+		save_installed_modules(modules)
+		print('Modulen ', enkelt_module, ' installerad.')
 
 
 def update(enkelt_module):
-	local_path = 'bib/' + enkelt_module + '.e'
 	web_path = web_import_location + enkelt_module + '.e'
+	modules = get_installed_modules()
 
-	if os.path.isfile(local_path):
+	if enkelt_module in modules:
 		try:
 			response = urllib.request.urlopen(web_path)
 			web_module_code = response.read().decode('utf-8')
+		except urllib.error.URLError:
+			print('Modulen', enkelt_module, 'kunde inte hittas.')
+			return
 
-			with open(local_path, 'r') as f:
-				local_module_code = f.read()
-				f.close()
-
-			if local_module_code != web_module_code:
-
-				with open(local_path, 'w') as f:
-					f.write(web_module_code)
-					f.close()
+		if modules[enkelt_module] != web_module_code:
+			modules[enkelt_module] = web_module_code
+			save_installed_modules(modules)
 
-					print('Modulen', enkelt_module, 'uppdaterades.')
-			else:
-				print('Redan uppdaterad.')
-		except Exception:
-			print('Modulen', enkelt_module, 'kunde inte hittas.')
+			print('Modulen', enkelt_module, 'uppdaterades.')
+		else:
+			print('Redan uppdaterad.')
 	else:
 		print('Ingen installerad modul vid namnet', enkelt_module, ' kunde hittas.')
 		ans = input('Vill du installera den? (J/n) ')
@@ -84,22 +109,22 @@ def update(enkelt_module):
 
 
 def uninstall(enkelt_module):
-	local_path = 'bib/' + enkelt_module + '.e'
-	if os.path.isfile(local_path):
-		os.remove(local_path)
-		if not os.path.isfile(local_path):
-			print('Modulen', enkelt_module, 'avinstallerades.')
+	modules = get_installed_modules()
+	if enkelt_module in modules:
+		del modules[enkelt_module]
+		save_installed_modules(modules)
+		print('Modulen', enkelt_module, 'avinstallerades.')
 	else:
 		print('Ingen installerad modul vid namnet ', enkelt_module, ' kunde hittas.')
 
 
 def list_installed_modules():
-	for file_name in os.listdir('bib'):
-		if file_name.endswith('.e'):
-			print(file_name[:-2])
+	for module_name in sorted(get_installed_modules()):
+		print(module_name)
 
 
 web_import_location = 'https://raw.githubusercontent.com/Enkelt/EnkeltBibliotek/master/bib/'
+library_bundle_path = enkelt.library_bundle_path
 help_message = '''
 Hur man använder lib:
 	python3 lib.py <kommando> [modulnamn]
@@ -1,3 +1,4 @@
+import sys
 import unittest
 import enkelt
 
@@ -38,6 +39,52 @@ def get_enkelt_lex(code):
     return enkelt.lex(enkelt.fix_up_code_line(code))
 
 
+# The character by character implementation of fix_up_code_line from Enkelt 4.2, used as reference
+def legacy_fix_up_code_line(statement, is_extension=False):
+    statement = statement.replace('\n', '')\
+                         .replace("'", '"')\
+                         .replace('\\"', '|-ENKELT_ESCAPED_QUOTE-|')\
+                         .replace('\\', '|-ENKELT_ESCAPED_BACKSLASH-|')
+    if not is_extension:
+        statement = statement.replace('\t', '')
+
+    current_line = ''
+    is_string = False
+    is_import = False
+
+    for char in statement:
+        if char == ' ' and not is_string and not is_import:
+            continue
+        elif char == '"':
+            is_string = not is_string
+        current_line += char
+
+        if current_line == 'importera':
+            is_import = True
+
+    return current_line
+
+
+def compile_enkelt_program(lines):
+    enkelt.reset_transpiler_state()
+
+    for line_number, line in enumerate(lines, 1):
+        enkelt.transpile_line(line, line_number)
+
+    return enkelt.compile_transpiled_code(enkelt.fix_up_and_prepare_transpiled_code())
+
+
+def run_compiled_enkelt_program(code):
+    import io
+    import contextlib
+
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        enkelt.execute_compiled_code(code, enkelt.get_program_namespace())
+
+    return output.getvalue()
+
+
 def standard_get_expected_output(is_parser, to_lex):
     lexed_code = get_enkelt_lex(to_lex)
 
@@ -204,6 +251,44 @@ class TestEnkelt(unittest.TestCase):
         self.assertEqual(enkelt.fix_up_code_line('importera test'), 'importera test')
         self.assertEqual(enkelt.fix_up_code_line('\\"'), '|-ENKELT_ESCAPED_QUOTE-|')
         self.assertEqual(enkelt.fix_up_code_line('\\'), '|-ENKELT_ESCAPED_BACKSLASH-|')
+        self.assertEqual(enkelt.fix_up_code_line('\tvänta  asynk.sov(1)'), 'vänta asynk.sov(1)')
+        self.assertEqual(enkelt.fix_up_code_line('returnera genomsnitt($a)'), 'returneragenomsnitt($a)')
+
+    def test_fix_up_code_line_matches_legacy(self):
+        import random
+
+        samples = list(real_sample_code) + list(non_real_sample_code) + [
+            'importera test', ' i mportera  en modul ', 'importera"a b" c', 'importerax y', '"importera" a b',
+            'utöka test', '\\\t"a  b"', "skriv('a \\' b')", 'a\tb "c\td" \n',
+        ]
+
+        # Random lines built from the characters that fix_up_code_line treats specially
+        generator = random.Random(4)
+        pieces = [' ', '  ', '"', "'", '\\', '\t', '\n', 'importera', 'skriv(', '$a', '=', '1', 'ö']
+        for _ in range(500):
+            samples.append(''.join(generator.choice(pieces) for _ in range(generator.randint(0, 12))))
+
+        for sample in samples:
+            for is_extension in [False, True]:
+                enkelt.is_extension = is_extension
+                self.assertEqual(
+                    enkelt.fix_up_code_line(sample),
+                    legacy_fix_up_code_line(sample, is_extension),
+                    repr(sample)
+                )
+        enkelt.is_extension = False
+
+    def test_fix_up_code_line_is_linear(self):
+        import time
+
+        long_line = '$a = "text med mellanslag " + ' * 35000
+
+        start_time = time.perf_counter()
+        fixed_line = enkelt.fix_up_code_line(long_line)
+        self.assertLess(time.perf_counter() - start_time, 1)
+
+        self.assertGreater(len(long_line), 1000000)
+        self.assertEqual(fixed_line, ('$a="text med mellanslag "+' * 35000))
 
     def test_has_numbers(self):
         self.assertEqual(enkelt.has_numbers('text'), False)
@@ -247,6 +332,903 @@ class TestEnkelt(unittest.TestCase):
     def test_translate_clear(self):
         self.assertEqual(enkelt.translate_clear(), 'clear')
 
+    def test_compile_transpiled_code(self):
+        code = compile_enkelt_program([
+            '$a = 1\n',
+            '\n',
+            'def dela_med_noll($b) {\n',
+            '\treturnera $b / 0\n',
+            '}\n',
+            '$c = dela_med_noll($a)\n',
+        ])
+
+        try:
+            enkelt.execute_compiled_code(code, enkelt.get_program_namespace())
+        except ZeroDivisionError as err:
+            self.assertEqual(enkelt.get_enkelt_line_number(err), 4)
+        else:
+            self.fail('ZeroDivisionError was not raised')
+
+        code = compile_enkelt_program(['$text = "a \\"b\\" c"\n', 'skriv($text)\n'])
+        self.assertEqual(run_compiled_enkelt_program(code), 'a "b" c\n')
+
+    def test_profiler(self):
+        code = compile_enkelt_program([
+            '$i = 0\n',
+            'medan ($i < 50) {\n',
+            '\t$i = $i + 1\n',
+            '}\n',
+        ])
+
+        profiler = enkelt.ProfilerClass(enkelt.get_transpiled_code_file_name())
+        sys.settrace(profiler.trace)
+        try:
+            enkelt.execute_compiled_code(code, enkelt.get_program_namespace())
+        finally:
+            sys.settrace(None)
+
+        self.assertEqual(profiler.line_hits[(3, '__enkelt__')], 50)
+        self.assertIn('huvudprogram', profiler.get_report())
+
+    def test_memory_profiler(self):
+        enkelt.is_fast_locals_mode = False
+        try:
+            code = compile_enkelt_program([
+                '$liten = [0] * 10\n',
+                'def skapa($antal) {\n',
+                '\treturnera [0] * $antal\n',
+                '}\n',
+                '$stor = skapa(100000)\n',
+            ])
+        finally:
+            enkelt.is_fast_locals_mode = True
+
+        profiler = enkelt.MemoryProfilerClass(enkelt.get_transpiled_code_file_name())
+        profiler.start()
+        try:
+            enkelt.execute_compiled_code(code, enkelt.get_program_namespace())
+        finally:
+            profiler.stop()
+
+        # The list is allocated inside the function, on the 3rd line
+        data = profiler.get_data()
+        self.assertEqual(data['lines'][0]['line'], 3)
+        self.assertGreaterEqual(data['lines'][0]['bytes_at_end'], 800000)
+        self.assertGreaterEqual(data['traced_peak'], 800000)
+        self.assertIn('Vid största mätningen', profiler.get_report())
+
+        # tracemalloc's own memory is reported on its own and not counted in the RSS
+        self.assertGreater(data['tracemalloc_memory'], 0)
+        if data['peak_rss'] is not None:
+            self.assertEqual(data['peak_rss'], max(0, profiler.peak_rss - data['tracemalloc_memory']))
+
+    def test_statistics(self):
+        statistics = enkelt.StatisticsClass()
+
+        statistics.start('parse')
+        statistics.start('import_library')
+        statistics.stop()
+        statistics.stop()
+        self.assertFalse(statistics.phase_stack)
+
+        enkelt.statistics = statistics
+        try:
+            compile_enkelt_program(['$a = 1\n', 'skriv($a)\n'])
+        finally:
+            enkelt.statistics = None
+
+        self.assertFalse(statistics.phase_stack)
+        self.assertEqual(enkelt.run_phase('lex', len, 'abc'), 3)
+
+        data = statistics.get_data()
+        self.assertEqual(data['counters']['lines'], 2)
+        self.assertGreater(data['phase_times']['parse'], 0)
+        self.assertEqual(data['counters']['tokens'], 6)
+        self.assertEqual(list(data['phase_times']), [phase for phase, _ in enkelt.StatisticsClass.phases])
+        self.assertIn('Lexning', statistics.get_report())
+
+    def test_transpiled_line_cache(self):
+        import collections
+
+        program = [
+            'def dubbel($n) {\n',
+            '\treturnera $n * 2\n',
+            '}\n',
+            'skriv(dubbel(2))\n',
+        ]
+        changed_program = program[:3] + ['skriv(dubbel(3))\n']
+
+        enkelt.transpiled_line_cache = collections.OrderedDict()
+        try:
+            compile_enkelt_program(program)
+            cached_lines = len(enkelt.transpiled_line_cache)
+            cached_code = compile_enkelt_program(changed_program)
+            cached_final = enkelt.final
+            self.assertEqual(len(enkelt.transpiled_line_cache), cached_lines + 1)
+
+            # The lines that aren't in the program anymore are removed first
+            enkelt.transpiled_line_cache_size = cached_lines
+            compile_enkelt_program(changed_program[:3] + ['skriv(dubbel(4))\n'])
+            self.assertEqual(
+                [line for line, _ in enkelt.transpiled_line_cache], program[:3] + ['skriv(dubbel(4))\n']
+            )
+        finally:
+            enkelt.transpiled_line_cache = None
+            enkelt.transpiled_line_cache_size = 1000
+
+        self.assertEqual(run_compiled_enkelt_program(cached_code), '6\n')
+
+        compile_enkelt_program(changed_program)
+        self.assertEqual(cached_final, enkelt.final)
+
+    def test_token(self):
+        token = enkelt.Token(enkelt.TokenKind.VAR, 'x')
+
+        self.assertEqual(token, ['VAR', 'x'])
+        self.assertEqual(token, enkelt.Token(enkelt.TokenKind.VAR, 'x'))
+        self.assertNotEqual(token, ['STRING', 'x'])
+        self.assertEqual(str([token]), "[['VAR', 'x']]")
+        self.assertEqual(list(token), ['VAR', 'x'])
+
+        token[-1] = 'y'
+        self.assertEqual((token[0], token[1], token.kind), ('VAR', 'y', enkelt.TokenKind.VAR))
+
+        # Every kind's number is its index in the names
+        self.assertEqual(
+            [getattr(enkelt.TokenKind, name) for name in enkelt.TokenKind.names], list(range(len(enkelt.TokenKind.names)))
+        )
+        self.assertFalse(hasattr(enkelt, '_kind') or hasattr(enkelt, '_name'))
+
+    def test_fast_locals_mode(self):
+        program = [
+            '$i = 0\n',
+            '$antal = 0\n',
+            'def öka() {\n',
+            '\tglobal $antal\n',
+            '\t$antal = $antal + 1\n',
+            '}\n',
+            'medan ($i < 3) {\n',
+            '\töka()\n',
+            '\t$i = $i + 1\n',
+            '}\n',
+            'skriv($antal)\n',
+        ]
+
+        code = compile_enkelt_program(program)
+        self.assertEqual(run_compiled_enkelt_program(code), '3\n')
+
+        # Only the names shared with functions are globals, the loop counter is a fast local
+        wrapper = [constant for constant in code.co_consts if hasattr(constant, 'co_varnames')][0]
+        self.assertEqual(wrapper.co_name, '__enkelt__')
+        self.assertIn('i', wrapper.co_varnames)
+        self.assertNotIn('antal', wrapper.co_varnames)
+        self.assertNotIn('öka', wrapper.co_varnames)
+
+    def test_memoize(self):
+        self.assertEqual(
+            [token.kind for token in enkelt.lex(enkelt.fix_up_code_line('minne(2) def dubbla($x) {'))],
+            [enkelt.TokenKind.MEMOIZE, enkelt.TokenKind.USER_FUNCTION, enkelt.TokenKind.VAR,
+             enkelt.TokenKind.OPERATOR, enkelt.TokenKind.START]
+        )
+
+        program = [
+            'minne def kvadrat($x) {\n',
+            '\tskriv("räknar")\n',
+            '\treturnera $x * $x\n',
+            '}\n',
+            'skriv(kvadrat(3))\n',
+            'skriv(kvadrat(3))\n',
+            'skriv(minne.info(kvadrat))\n',
+            'minne.rensa(kvadrat)\n',
+            'skriv(kvadrat(3))\n',
+            'minne(2) def dubbla($x) {\n',
+            '\treturnera $x * 2\n',
+            '}\n',
+            'skriv(minne.info(dubbla))\n',
+        ]
+
+        self.assertEqual(run_compiled_enkelt_program(compile_enkelt_program(program)), ''.join([
+            'räknar\n',
+            '9\n',
+            '9\n',
+            "{'träffar': 1, 'missar': 1, 'storlek': 1, 'maxstorlek': 1024}\n",
+            'räknar\n',
+            '9\n',
+            "{'träffar': 0, 'missar': 0, 'storlek': 0, 'maxstorlek': 2}\n",
+        ]))
+
+    def test_generator(self):
+        import os
+        import tempfile
+
+        with tempfile.TemporaryDirectory() as directory:
+            file_path = os.path.join(directory, 'rader.txt')
+            with open(file_path, 'w', encoding='utf-8') as file:
+                file.write('a\nb\n')
+
+            program = [
+                'def jämna($n) {\n',
+                '\tför ($i; inom området(0, $n)) {\n',
+                '\t\tom ($i % 2 == 0) {\n',
+                '\t\t\tge $i\n',
+                '\t\t}\n',
+                '\t}\n',
+                '}\n',
+                'för ($x; inom jämna(5)) {\n',
+                '\tskriv($x)\n',
+                '}\n',
+                'för ($rad; inom öppna("' + file_path + '", "l")) {\n',
+                '\tskriv($rad.versal())\n',
+                '}\n',
+            ]
+
+            self.assertEqual(run_compiled_enkelt_program(compile_enkelt_program(program)), '0\n2\n4\nA\nB\n')
+
+    def test_generator_keyword_is_whole_word(self):
+        # genomsnitt is defined after it's called, so it isn't a known function when "returnera genomsnitt(" is lexed
+        program = [
+            'def hej() {\n',
+            '\treturnera genomsnitt([1, 2, 3])\n',
+            '}\n',
+            'def genomsnitt($lista) {\n',
+            '\treturnera ($lista[0] + $lista[1] + $lista[2]) / längd($lista)\n',
+            '}\n',
+            'def väntande() {\n',
+            '\tge väntan()\n',
+            '}\n',
+            'def väntan() {\n',
+            '\treturnera 1\n',
+            '}\n',
+            'skriv(hej())\n',
+            'skriv(lista(väntande()))\n',
+        ]
+
+        self.assertEqual(run_compiled_enkelt_program(compile_enkelt_program(program)), '2.0\n[1]\n')
+
+    def test_generator_keyword_outside_function(self):
+        # The program would otherwise become a generator that never runs
+        with self.assertRaises(SyntaxError) as context:
+            compile_enkelt_program(['skriv("start")\n', 'ge 5\n', 'skriv("slut")\n'])
+        self.assertEqual(context.exception.lineno, 2)
+        self.assertIn('funktion', context.exception.msg)
+
+        with self.assertRaises(SyntaxError):
+            compile_enkelt_program(['om (Sant) {\n', '\tskriv(ge 5)\n', '}\n'])
+
+    def test_comprehension(self):
+        self.assertEqual(
+            [token.kind for token in enkelt.lex(enkelt.fix_up_code_line('[$x * 2 för $x inom $lista om $x > 0]'))],
+            [enkelt.TokenKind.LIST_START, enkelt.TokenKind.VAR, enkelt.TokenKind.OPERATOR, enkelt.TokenKind.PNUMBER,
+             enkelt.TokenKind.COMPREHENSION_FOR, enkelt.TokenKind.VAR, enkelt.TokenKind.KEYWORD, enkelt.TokenKind.VAR,
+             enkelt.TokenKind.KEYWORD, enkelt.TokenKind.VAR, enkelt.TokenKind.OPERATOR, enkelt.TokenKind.PNUMBER,
+             enkelt.TokenKind.LIST_END]
+        )
+
+        program = [
+            '$lista = [3, -1, 4]\n',
+            'skriv([$x * 2 för $x inom $lista om $x > 0])\n',
+            '$lexikon = {"a": 1, "b": 2}\n',
+            'skriv({$k: $lexikon[$k] * 10 för $k inom $lexikon})\n',
+            'def positiva($l) {\n',
+            '\treturnera [$x för $x inom $l om $x > 0]\n',
+            '}\n',
+            'skriv(positiva($lista))\n',
+        ]
+
+        self.assertEqual(
+            run_compiled_enkelt_program(compile_enkelt_program(program)),
+            "[6, 8]\n{'a': 10, 'b': 20}\n[3, 4]\n"
+        )
+
+    def test_parallel(self):
+        program = [
+            'def kvadrat($x) {\n',
+            '\treturnera $x * $x\n',
+            '}\n',
+            'def udda($x) {\n',
+            '\treturnera $x % 2 == 1\n',
+            '}\n',
+            'parallell.arbetare(2)\n',
+            'skriv(parallell.karta(kvadrat, området(10)))\n',
+            'skriv(parallell.filtrera(udda, området(10), 3))\n',
+        ]
+
+        worker_count = enkelt.StandardLibrary.parallell.antal_arbetare
+        try:
+            self.assertEqual(
+                run_compiled_enkelt_program(compile_enkelt_program(program)),
+                '[0, 1, 4, 9, 16, 25, 36, 49, 64, 81]\n[1, 3, 5, 7, 9]\n'
+            )
+        finally:
+            enkelt.StandardLibrary.parallell.antal_arbetare = worker_count
+
+    def test_async(self):
+        import os
+        import tempfile
+        import threading
+        import http.server
+
+        class RequestHandler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = self.path.encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), RequestHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = 'http://127.0.0.1:' + str(server.server_address[1])
+
+        try:
+            with tempfile.TemporaryDirectory() as directory:
+                file_path = os.path.join(directory, 'fil.txt')
+                with open(file_path, 'w', encoding='utf-8') as file:
+                    file.write('innehåll')
+
+                program = [
+                    'asynk def dubbel($x) {\n',
+                    '\tvänta asynk.sov(0.01)\n',
+                    '\treturnera $x * 2\n',
+                    '}\n',
+                    'skriv(vänta asynk.samla(dubbel(1), dubbel(2)))\n',
+                    'skriv(vänta asynk.samla(asynk.hämta("' + url + '/a"), asynk.hämta("' + url + '/b")))\n',
+                    'skriv(vänta asynk.läs("' + file_path + '"))\n',
+                ]
+
+                code = compile_enkelt_program(program)
+                self.assertEqual(run_compiled_enkelt_program(code), "[2, 4]\n['/a', '/b']\ninnehåll\n")
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_timing(self):
+        self.assertEqual(enkelt.format_duration(999), '999 ns')
+        self.assertEqual(enkelt.format_duration(1500000), '1,500 ms')
+
+        program = [
+            'def räkna() {\n',
+            '\treturnera längd(området(100))\n',
+            '}\n',
+            'tidtagning("block") {\n',
+            '\träkna()\n',
+            '}\n',
+            '$resultat = tid.jämför(räkna, 20)\n',
+            'skriv($resultat["gånger"])\n',
+            'skriv($resultat["min"] <= $resultat["median"] <= $resultat["p99"] <= $resultat["max"])\n',
+        ]
+
+        output = run_compiled_enkelt_program(compile_enkelt_program(program)).split('\n')
+        self.assertTrue(output[0].startswith('Tidtagning block: '))
+        self.assertEqual(output[1:], ['20', 'Sant', ''])
+
+    def test_file_module(self):
+        import os
+        import tempfile
+
+        with tempfile.TemporaryDirectory() as directory:
+            file_path = os.path.join(directory, 'logg.txt')
+
+            program = [
+                'fil.skriv_alla("' + file_path + '", ["fel: ett", "två"])\n',
+                'fil.skriv_alla("' + file_path + '", ["fel: tre"], Sant)\n',
+                'skriv(lista(fil.rader("' + file_path + '")))\n',
+                '$m = fil.mappa("' + file_path + '")\n',
+                'skriv($m.räkna("fel:"))\n',
+                'skriv($m[$m.sök("två"):längd($m)])\n',
+                '$m.stäng()\n',
+                'skriv(lista(fil.läs_bytes("' + file_path + '", 10)))\n',
+            ]
+
+            self.assertEqual(run_compiled_enkelt_program(compile_enkelt_program(program)), ''.join([
+                "['fel: ett', 'två', 'fel: tre']\n",
+                '2\n',
+                'två\nfel: tre\n\n',
+                "[b'fel: ett\\nt', b'v\\xc3\\xa5\\nfel: t', b're\\n']\n",
+            ]))
+
+    def test_data_module(self):
+        import os
+        import tempfile
+
+        with tempfile.TemporaryDirectory() as directory:
+            csv_path = os.path.join(directory, 'tabell.csv')
+            json_path = os.path.join(directory, 'data.json')
+            jsonl_path = os.path.join(directory, 'poster.jsonl')
+
+            program = [
+                'data.csv_skriv("' + csv_path + '", [{"namn": "Åsa, Berg", "ålder": 30}, {"namn": "Bo", "ålder": 4}])\n',
+                'för ($rad; inom data.csv_rader("' + csv_path + '", ",", Sant)) {\n',
+                '\tskriv($rad["namn"])\n',
+                '}\n',
+                'data.json_skriv("' + json_path + '", {"aktiv": Sant, "tal": [1, 2]})\n',
+                'skriv(data.json_läs("' + json_path + '"))\n',
+                'data.jsonl_skriv("' + jsonl_path + '", [[1], [2, 3]])\n',
+                'skriv(lista(data.jsonl_rader("' + jsonl_path + '")))\n',
+            ]
+
+            self.assertEqual(run_compiled_enkelt_program(compile_enkelt_program(program)), ''.join([
+                'Åsa, Berg\n',
+                'Bo\n',
+                "{'aktiv': Sant, 'tal': [1, 2]}\n",
+                '[[1], [2, 3]]\n',
+            ]))
+
+    def test_collections_module(self):
+        program = [
+            '$kö = samlingar.kö([1, 2, 3])\n',
+            '$kö.till(4)\n',
+            'skriv($kö.bort(0))\n',
+            'skriv($kö)\n',
+            '$mängd = samlingar.mängd([1, 2])\n',
+            '$mängd.till(2)\n',
+            'skriv($mängd)\n',
+            'skriv(samlingar.mängd())\n',
+            '$räknare = samlingar.räknare("abracadabra")\n',
+            'skriv($räknare.vanligast(1))\n',
+            '$prioritetskö = samlingar.prioritetskö([5, 1, 3])\n',
+            '$prioritetskö.lägg("först", 0)\n',
+            'skriv($prioritetskö.ta())\n',
+            'skriv($prioritetskö)\n',
+            'skriv(samlingar.topp(2, [3, 9, 1, 7]))\n',
+            'skriv(samlingar.botten(2, [3, 9, 1, 7]))\n',
+            'skriv(typ($kö))\n',
+            'skriv($räknare + samlingar.räknare("a"))\n',
+            'skriv($mängd - $mängd)\n',
+            'skriv(["deque(", "Counter(", "set()"])\n',
+        ]
+
+        self.assertEqual(run_compiled_enkelt_program(compile_enkelt_program(program)), ''.join([
+            '1\n',
+            'kö([2, 3, 4])\n',
+            'mängd({1, 2})\n',
+            'mängd()\n',
+            "[('a', 5)]\n",
+            'först\n',
+            'prioritetskö([1, 3, 5])\n',
+            '[9, 7]\n',
+            '[1, 3]\n',
+            'kö\n',
+            "räknare({'a': 6, 'b': 2, 'r': 2, 'c': 1, 'd': 1})\n",
+            'mängd()\n',
+            "['deque(', 'Counter(', 'set()']\n",
+        ]))
+
+    def test_pattern_module(self):
+        program = [
+            '$rad = "2024-05-01 FEL disk full, fel nät nere"\n',
+            'skriv(mönster.hitta("(\\\\d+)-(\\\\d+)", $rad))\n',
+            'skriv(mönster.hitta("FEL \\\\w+", $rad))\n',
+            '$fel = mönster.kompilera("fel (\\\\w+)", Sant)\n',
+            'skriv(lista(mönster.hitta_alla($fel, $rad)))\n',
+            'skriv(mönster.ersätt("\\\\d", $rad, "#", 4))\n',
+            'skriv(mönster.dela(",\\\\s*", $rad))\n',
+            'skriv(mönster.matchar("saknas", $rad))\n',
+            'skriv(mönster.hitta("saknas", $rad))\n',
+            'skriv($fel)\n',
+            'skriv("re.compile(")\n',
+        ]
+
+        enkelt.StandardLibrary.mönster.kompilera.cache_clear()
+        self.assertEqual(run_compiled_enkelt_program(compile_enkelt_program(program)), ''.join([
+            "['2024', '05']\n",
+            'FEL disk\n',
+            "['disk', 'nät']\n",
+            '####-05-01 FEL disk full, fel nät nere\n',
+            "['2024-05-01 FEL disk full', 'fel nät nere']\n",
+            'Falskt\n',
+            'None\n',
+            "mönster.kompilera('fel (\\\\w+)', Sant)\n",
+            're.compile(\n',
+        ]))
+
+        # The compiled patterns are shared between calls, and can be passed around as values
+        program = [
+            'för ($i; inom området(0, 3)) {\n',
+            '\tmönster.hitta("\\\\d+", "abc 123")\n',
+            '}\n',
+            'skriv(minne.info(mönster.kompilera)["träffar"])\n',
+        ]
+        enkelt.StandardLibrary.mönster.kompilera.cache_clear()
+        self.assertEqual(run_compiled_enkelt_program(compile_enkelt_program(program)), '2\n')
+
+        # Functions at the end of a line and in lists are values too, compiled patterns aren't put in the cache
+        program = [
+            '$f = mönster.hitta\n',
+            'skriv($f("\\\\d+", "a 12"))\n',
+            '$l = [mönster.matchar, mönster.hitta]\n',
+            'skriv($l[1]("\\\\d+", "b 34"))\n',
+            '$p = mönster.kompilera("x")\n',
+            'skriv(mönster.matchar($p, "axb"))\n',
+            'skriv(minne.info(mönster.kompilera)["storlek"])\n',
+        ]
+        enkelt.StandardLibrary.mönster.kompilera.cache_clear()
+        self.assertEqual(run_compiled_enkelt_program(compile_enkelt_program(program)), '12\n34\nSant\n2\n')
+
+    def test_for_each(self):
+        import os
+        import io
+        import json
+        import tempfile
+        import contextlib
+
+        with tempfile.TemporaryDirectory() as directory:
+            input_paths = []
+            for number in range(1, 4):
+                input_paths.append(os.path.join(directory, str(number) + '.txt'))
+                with open(input_paths[-1], 'w', encoding='utf-8') as input_file:
+                    input_file.write('\n'.join(str(term) for term in range(1, number + 1)) + '\n')
+            # exit() only ends the run of its own input
+            input_paths.append(os.path.join(directory, 'avsluta.txt'))
+            with open(input_paths[-1], 'w', encoding='utf-8') as input_file:
+                input_file.write('99\n')
+            results_path = os.path.join(directory, 'resultat.json')
+
+            enkelt.reset_transpiler_state()
+            enkelt.for_each_inputs = input_paths + [os.path.join(directory, 'saknas.txt')]
+            enkelt.for_each_workers = 2
+            enkelt.for_each_results_path = results_path
+            try:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    is_ok = enkelt.for_each_mode([
+                        '$summa = 0\n',
+                        'för ($tal; inom in_alla()) {\n',
+                        '\tom ($tal == 99) {\n',
+                        '\t\texit(3)\n',
+                        '\t}\n',
+                        '\t$summa = $summa + $tal\n',
+                        '}\n',
+                        'skriv($summa)\n',
+                    ])
+            finally:
+                enkelt.for_each_inputs = None
+                enkelt.for_each_workers = 0
+                enkelt.for_each_results_path = ''
+
+            self.assertFalse(is_ok)
+            with open(results_path, encoding='utf-8') as results_file:
+                results = json.load(results_file)
+            self.assertEqual([result['output'] for result in results[:3]], ['1\n', '3\n', '6\n'])
+            self.assertEqual([result['ok'] for result in results], [True, True, True, False, False])
+            self.assertEqual([result['exit_code'] for result in results], [0, 0, 0, 3, 1])
+
+        self.assertRaises(ValueError, enkelt.apply_flags, ['--arbetare=två'])
+        self.assertRaises(ValueError, enkelt.apply_flags, ['--arbetare=0'])
+
+    def test_streaming_input(self):
+        import io
+
+        self.assertEqual(enkelt.convert_input(' -12\n'), -12)
+        self.assertEqual(enkelt.convert_input('1.5e3'), 1500.0)
+        self.assertEqual(enkelt.convert_input('12 apor'), '12 apor')
+        self.assertEqual(enkelt.convert_input('1_000'), 1000)
+        self.assertEqual(enkelt.convert_input('inf'), float('inf'))
+        self.assertEqual(enkelt.convert_input('-Infinity'), float('-inf'))
+        self.assertEqual(enkelt.convert_input('1_0.2_5'), 10.25)
+        self.assertEqual(enkelt.convert_input('1__0'), '1__0')
+        # Longer than int()'s limit on digits (Python 3.11 and newer)
+        if enkelt.get_int_max_str_digits():
+            self.assertEqual(enkelt.convert_input('1' * 5000), '1' * 5000)
+
+        # in() keeps the text as it was typed when it isn't a number
+        stdin = sys.stdin
+        sys.stdin = io.StringIO(' hej \n1_000\n')
+        try:
+            self.assertEqual(enkelt.enkelt_input(), ' hej ')
+            self.assertEqual(enkelt.enkelt_input(), 1000)
+        finally:
+            sys.stdin = stdin
+
+        program = [
+            '$först = in_tal()\n',
+            '$rad = in_lista()\n',
+            '$summa = 0\n',
+            'för ($x; inom in_alla()) {\n',
+            '\t$summa = $summa + $x\n',
+            '}\n',
+            'skriv($först)\n',
+            'skriv($rad)\n',
+            'skriv($summa)\n',
+        ]
+
+        stdin = sys.stdin
+        sys.stdin = io.StringIO('7\n1, 2.5 tre\n1\n2\n3\n')
+        try:
+            output = run_compiled_enkelt_program(compile_enkelt_program(program))
+        finally:
+            sys.stdin = stdin
+
+        self.assertEqual(output, "7\n[1, 2.5, 'tre']\n6\n")
+
+    def test_service(self):
+        import os
+        import time
+        import tempfile
+        import subprocess
+
+        with tempfile.TemporaryDirectory() as directory:
+            socket_path = os.path.join(directory, 'enkelt.sock')
+            script_path = os.path.join(directory, 'dubbla.e')
+            with open(script_path, 'w', encoding='utf-8') as script_file:
+                script_file.write('$x = in()\nskriv($x * 2)\n')
+
+            environment = {key: value for key, value in os.environ.items() if key != 'ENKELT_DEV'}
+            service = subprocess.Popen(
+                [sys.executable, 'enkelt.py', '--tjänst=' + socket_path],
+                env=environment, stdout=subprocess.DEVNULL
+            )
+            try:
+                for _ in range(100):
+                    if os.path.exists(socket_path):
+                        break
+                    time.sleep(0.05)
+
+                client = subprocess.run(
+                    [sys.executable, 'enkelt_klient.py', '--tjänst=' + socket_path, script_path],
+                    input='21\n', capture_output=True, text=True, timeout=10
+                )
+                self.assertEqual((client.stdout, client.returncode), ('42\n', 0))
+
+                client = subprocess.run(
+                    [sys.executable, 'enkelt_klient.py', '--tjänst=' + socket_path, 'saknas.e'],
+                    capture_output=True, text=True, timeout=10
+                )
+                self.assertEqual(client.returncode, 1)
+            finally:
+                service.terminate()
+                service.wait(timeout=10)
+
+            self.assertFalse(os.path.exists(socket_path))
+
+    def test_service_socket_directory(self):
+        import io
+        import os
+        import tempfile
+        import contextlib
+        import enkelt_klient
+
+        environment = os.environ.copy()
+        try:
+            os.environ['XDG_RUNTIME_DIR'] = '/run/user/1000'
+            self.assertEqual(enkelt_klient.get_service_socket_path(), '/run/user/1000/enkelt.sock')
+            del os.environ['XDG_RUNTIME_DIR']
+            self.assertEqual(
+                enkelt_klient.get_service_socket_path(),
+                os.path.join(tempfile.gettempdir(), 'enkelt-' + str(os.getuid()), 'enkelt.sock')
+            )
+        finally:
+            os.environ.clear()
+            os.environ.update(environment)
+
+        # The service doesn't start in a directory that other users can write to
+        with tempfile.TemporaryDirectory() as directory:
+            os.chmod(directory, 0o777)
+            socket_path = os.path.join(directory, 'enkelt.sock')
+
+            output = io.StringIO()
+            with contextlib.redirect_stdout(output):
+                enkelt.service_mode(socket_path)
+
+            self.assertIn('chmod 700', output.getvalue())
+            self.assertFalse(os.path.exists(socket_path))
+
+    def test_service_library_bundle(self):
+        import os
+        import tempfile
+
+        with tempfile.TemporaryDirectory() as directory:
+            self.assertIsNone(enkelt.get_service_library_bundle(directory))
+
+            bundle_path = os.path.join(directory, enkelt.library_bundle_path)
+            os.makedirs(os.path.dirname(bundle_path))
+            enkelt.LibraryBundleClass.write(bundle_path, {
+                'verktyg': enkelt.get_bundle_entry('verktyg', 'def dubbla($a) {\n\treturnera $a * 2\n}\n'),
+            })
+
+            # The bundle is opened once, and again when lib.py has written a new one
+            bundle = enkelt.get_service_library_bundle(directory)
+            try:
+                self.assertIs(enkelt.get_service_library_bundle(directory), bundle)
+                enkelt.LibraryBundleClass.write(bundle_path, {})
+                new_bundle = enkelt.get_service_library_bundle(directory)
+                self.assertIsNot(new_bundle, bundle)
+                self.assertEqual(new_bundle.libraries, {})
+            finally:
+                for _, service_bundle in enkelt.service_library_bundles.values():
+                    service_bundle.close()
+                enkelt.service_library_bundles.clear()
+
+    def test_sandbox_pool(self):
+        import os
+        import time
+        import tempfile
+        import enkelt_sandlada
+
+        escaped_path = os.path.join(tempfile.mkdtemp(), 'rymde')
+
+        with enkelt_sandlada.SandboxPool(workers=2, cpu_seconds=1, timeout=1.5, max_output=100) as pool:
+            results = pool.map([
+                '$x = 2\nskriv($x * 21)\n',
+                'medan (Sant) {\n\t$x = 1\n}\n',
+                '$x = [0] * 100000000\n',
+                'medan (Sant) {\n\tskriv("text")\n}\n',
+                'vänta asynk.sov(5)\n',
+                # A job that closes its output is still stopped at the deadline
+                '$os = __import__("os")\n$os.close(1)\n$os.close(2)\n$t = __import__("time")\n$t.sleep(8)\n',
+                # and so is a process that it starts and that leaves the job's process group
+                '$os = __import__("os")\n$t = __import__("time")\n$pid = $os.fork()\nom ($pid == 0) {\n'
+                '\t$os.setsid()\n\t$t.sleep(2.5)\n\t$os.mkdir("' + escaped_path + '")\n}\n',
+            ])
+            self.assertEqual(
+                [result.status for result in results],
+                ['ok', 'cpu_limit', 'memory_limit', 'output_limit', 'timeout', 'timeout', 'timeout']
+            )
+            self.assertEqual(results[0].output, '42\n')
+            self.assertEqual(len(results[3].output), 100)
+            self.assertLess(results[5].duration, 3)
+
+            time.sleep(1.5)
+            self.assertFalse(os.path.exists(escaped_path))
+
+            # The workers are reused for every job
+            results = pool.map(['skriv(' + str(number) + ')\n' for number in range(100)])
+            self.assertEqual([result.output for result in results], [str(number) + '\n' for number in range(100)])
+
+        # A job can start processes of its own. The memory limit is for the whole address space,
+        # which the jobs inherit from the test process.
+        with enkelt_sandlada.SandboxPool(workers=1, memory_bytes=2 * 1024 * 1024 * 1024) as pool:
+            result = pool.submit(
+                'def kvadrat($x) {\n\treturnera $x * $x\n}\nparallell.arbetare(2)\nskriv(parallell.karta(kvadrat, området(5)))\n'
+            ).result()
+            self.assertEqual((result.status, result.output), ('ok', '[0, 1, 4, 9, 16]\n'))
+        self.assertFalse(any(worker.is_alive() for worker in pool.workers))
+
+    def test_language_server(self):
+        import os
+        import io
+        import json
+        import enkelt_lsp
+
+        document = enkelt_lsp.EnkeltDocument('def hej($a) {\n\treturnera $a + 1\n}\n$x = hej(2)\n')
+        # Only the line that defines a function is lexed when the document is opened
+        self.assertEqual([tokens is None for tokens in document.tokens], [False, True, True, True, True])
+        self.assertEqual(document.get_definition_line(3, 6), 0)
+        self.assertEqual(document.get_diagnostics(), [])
+
+        # The first token of a range counts its line from the start of the document
+        self.assertEqual(
+            document.get_semantic_tokens(3, 3),
+            [3, 0, 2, 2, 0, 0, 3, 1, 5, 0, 0, 2, 3, 1, 0, 0, 4, 1, 4, 0, 0, 1, 1, 5, 0]
+        )
+
+        # Only the changed line is lexed again, until a function is renamed
+        first_line_tokens = document.tokens[0]
+        document.apply_change({
+            'range': {'start': {'line': 1, 'character': 16}, 'end': {'line': 1, 'character': 17}},
+            'text': '2',
+        })
+        self.assertEqual(document.lines[1], '\treturnera $a + 2')
+        self.assertIs(document.tokens[0], first_line_tokens)
+
+        document.apply_change({
+            'range': {'start': {'line': 0, 'character': 4}, 'end': {'line': 0, 'character': 7}},
+            'text': 'hejsan',
+        })
+        self.assertEqual(document.get_definition_line(3, 6), None)
+        self.assertEqual(document.line_functions[0], ('hejsan',))
+        self.assertIsNone(document.tokens[3])
+        self.assertEqual(document.get_semantic_tokens(3, 3)[:5], [3, 0, 2, 2, 0])
+
+        document.apply_change({'text': '$y = (\n'})
+        diagnostics = document.get_diagnostics()
+        self.assertEqual(len(diagnostics), 1)
+        self.assertTrue(diagnostics[0]['message'].startswith('Syntaxfel: '))
+
+        # The dry run never fetches libraries
+        enkelt.is_offline = True
+        try:
+            document.apply_change({'text': 'importera ett_bibliotek_som_inte_finns\n$y = 1\n'})
+            self.assertEqual(document.get_diagnostics(), [])
+            self.assertNotIn('ett_bibliotek_som_inte_finns', enkelt.imported_libraries)
+        finally:
+            enkelt.is_offline = False
+
+        # A whole session over the protocol
+        messages = [
+            {'jsonrpc': '2.0', 'id': 1, 'method': 'initialize', 'params': {}},
+            {'jsonrpc': '2.0', 'method': 'textDocument/didOpen', 'params': {
+                'textDocument': {'uri': 'file:///test.e', 'text': 'def hej() {\n}\nhej()\n'}
+            }},
+            {'jsonrpc': '2.0', 'id': 2, 'method': 'textDocument/definition', 'params': {
+                'textDocument': {'uri': 'file:///test.e'}, 'position': {'line': 2, 'character': 1}
+            }},
+            {'jsonrpc': '2.0', 'id': 3, 'method': 'shutdown'},
+            {'jsonrpc': '2.0', 'method': 'exit'},
+        ]
+        read_fd, write_fd = os.pipe()
+        for message in messages:
+            body = json.dumps(message).encode('utf-8')
+            os.write(write_fd, b'Content-Length: ' + str(len(body)).encode('ascii') + b'\r\n\r\n' + body)
+        os.close(write_fd)
+
+        output = io.BytesIO()
+        enkelt_lsp.LanguageServer(read_fd, output).run()
+        os.close(read_fd)
+
+        responses = [
+            json.loads(body) for body in output.getvalue().split(b'\r\n\r\n')[1:]
+            for body in [body[:body.rfind(b'}') + 1]]
+        ]
+        self.assertIn('semanticTokensProvider', responses[0]['result']['capabilities'])
+        self.assertEqual(responses[1]['result']['range']['start']['line'], 0)
+        self.assertEqual(responses[2]['result'], None)
+
+    def test_library_bundle(self):
+        import os
+        import tempfile
+
+        with tempfile.TemporaryDirectory() as directory:
+            bundle_path = os.path.join(directory, 'bibliotek.ebib')
+            enkelt.LibraryBundleClass.write(bundle_path, {
+                'verktyg': enkelt.get_bundle_entry('verktyg', 'def dubbla($a) {\n\treturnera $a * 2\n}\n'),
+            })
+
+            library_bundle_path = enkelt.library_bundle_path
+            enkelt.library_bundle_path = bundle_path
+            enkelt.library_bundle = None
+            try:
+                program = ['importera verktyg\n', 'skriv(verktyg.dubbla(21))\n']
+                self.assertEqual(run_compiled_enkelt_program(compile_enkelt_program(program)), '42\n')
+                self.assertEqual(enkelt.user_functions, ['verktyg.dubbla'])
+
+                # An imported function can be passed as a value
+                program_with_value = ['importera verktyg\n', '$f = [verktyg.dubbla]\n', 'skriv($f[0](4))\n']
+                self.assertEqual(run_compiled_enkelt_program(compile_enkelt_program(program_with_value)), '8\n')
+
+                # The Enkelt code is transpiled when the pre-transpiled code is from another transpiler,
+                # even one with the same version number
+                self.assertEqual(enkelt.library_bundle.transpiler_fingerprint, enkelt.get_transpiler_fingerprint())
+                enkelt.library_bundle.close()
+                enkelt.LibraryBundleClass.write(bundle_path, {
+                    'verktyg': dict(enkelt.get_bundle_entry('verktyg', 'def dubbla($a) {\n\treturnera $a * 2\n}\n'),
+                                    python='def verktyg__enkelt__dubbla(a):\n\treturn a*3\n'),
+                })
+                enkelt.library_bundle = None
+                self.assertEqual(run_compiled_enkelt_program(compile_enkelt_program(program)), '63\n')
+
+                enkelt.library_bundle.transpiler_fingerprint = 'en annan transpilerare'
+                self.assertEqual(run_compiled_enkelt_program(compile_enkelt_program(program)), '42\n')
+
+                self.assertEqual(list(enkelt.library_bundle.libraries), ['verktyg'])
+
+                # A library that imports another installed library is transpiled with the other library's code
+                # from the bundle being written, one that imports a library from the web only gets its Enkelt code
+                sources = {
+                    'verktyg': 'def dubbla($a) {\n\treturnera $a * 2\n}\n',
+                    'mer': 'importera verktyg\ndef fyrdubbla($a) {\n\treturnera verktyg.dubbla($a) * 2\n}\n',
+                    'webb': 'importera ett_bibliotek_på_webben\n',
+                }
+                entries = {name: enkelt.get_bundle_entry(name, sources[name], sources) for name in sources}
+                self.assertEqual(entries['mer']['importerar'], ['verktyg'])
+                self.assertIsNone(entries['webb']['python'])
+                self.assertFalse(enkelt.is_offline)
+
+                enkelt.library_bundle.close()
+                enkelt.LibraryBundleClass.write(bundle_path, entries)
+                enkelt.library_bundle = None
+                program = ['importera mer\n', 'skriv(mer.fyrdubbla(2))\n']
+                self.assertEqual(run_compiled_enkelt_program(compile_enkelt_program(program)), '8\n')
+                self.assertNotIn('python', enkelt.library_bundle.libraries['webb'])
+                enkelt.library_bundle.libraries['verktyg']['sha256']['källa'] = ''
+                self.assertRaises(ValueError, enkelt.library_bundle.read, 'verktyg', 'källa')
+            finally:
+                enkelt.library_bundle.close()
+                enkelt.library_bundle_path = library_bundle_path
+                enkelt.library_bundle = None
+
     def test_lex(self):
         # ###################### #
         #  NON REAL SAMPLE CODE  #